@@ -1,11 +1,15 @@
+import asyncio
 import logging
+import queue
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from engine import WorkflowEngine
+from pydantic import BaseModel, field_validator
+from engine import WorkflowEngine, workflow_version
+from nodes import close_shared_clients
 from dotenv import load_dotenv
-from session_manager import SessionManager
+from session_manager import SESSIONS, clean_session_id
 
 
 load_dotenv()
@@ -14,10 +18,38 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_WORKFLOW = "workflow_example.json"
+# A slow or unreachable LLM endpoint must not hold up server startup.
+WARM_UP_TIMEOUT = 5.0
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Builds the default workflow and warms its connections before the first request,
+    so nobody pays the cold start. Warm-up gives up after WARM_UP_TIMEOUT seconds.
+    On shutdown, writes any debounced session saves and closes the shared HTTP client.
+    """
+    try:
+        engine, version = await _acquire_engine(DEFAULT_WORKFLOW)
+        try:
+            await asyncio.wait_for(engine.warm_up(), timeout=WARM_UP_TIMEOUT)
+            logger.info('Default workflow %s warmed up', DEFAULT_WORKFLOW)
+        except asyncio.TimeoutError:
+            logger.warning('Warm-up of %s took over %g s; starting without it', DEFAULT_WORKFLOW, WARM_UP_TIMEOUT)
+        _release_engine(DEFAULT_WORKFLOW, version, engine)
+    except Exception as e:
+        logger.error('Could not warm up default workflow: %s', e)
+    yield
+    await asyncio.to_thread(session_manager.close)
+    await close_shared_clients()
+
+
 app = FastAPI(
     title="Simple-Node API",
     description="Api for executing workflows nodes",
     version="0.1.0",
+    lifespan=lifespan,
     )
 
 app.add_middleware(
@@ -28,13 +60,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-session_manager = SessionManager()
+session_manager = SESSIONS
+
+ENGINE_POOL_SIZE = 32
+_ENGINE_POOL: dict[str, tuple[int, queue.LifoQueue]] = {}
+
+
+async def _acquire_engine(workflow_config: str) -> tuple[WorkflowEngine, int]:
+    """
+    Takes a warm engine for the given workflow from the pool.
+    Builds a new one when the pool is empty or the workflow file changed on disk;
+    that parses the file, so it runs in a worker thread to keep other streams flowing.
+    Returns the engine and the file version it was built from.
+    """
+    mtime_ns = workflow_version(workflow_config)
+    version, pool = _ENGINE_POOL.get(workflow_config, (None, None))
+    if version == mtime_ns:
+        try:
+            return pool.get_nowait(), mtime_ns
+        except queue.Empty:
+            pass
+    engine = await asyncio.to_thread(WorkflowEngine.load_from_json, workflow_config, session_manager=session_manager)
+    return engine, mtime_ns
+
+
+def _release_engine(workflow_config: str, mtime_ns: int, engine: WorkflowEngine) -> None:
+    """Resets an engine and returns it to the pool, dropping it if it is stale or the pool is full."""
+    engine.reset()
+    version, pool = _ENGINE_POOL.get(workflow_config, (None, None))
+    if version != mtime_ns:
+        if version is not None and version > mtime_ns:
+            return
+        pool = queue.LifoQueue(maxsize=ENGINE_POOL_SIZE)
+        _ENGINE_POOL[workflow_config] = (mtime_ns, pool)
+    try:
+        pool.put_nowait(engine)
+    except queue.Full:
+        pass
 
 class WorkflowRequest(BaseModel):
     input_data: str
-    workflow_config: str = "workflow_example.json"
+    workflow_config: str = DEFAULT_WORKFLOW
     session_id: str | None = None
 
+    @field_validator('session_id')
+    @classmethod
+    def _plain_session_id(cls, session_id: str | None) -> str | None:
+        return clean_session_id(session_id) if session_id else session_id
+
+
+async def _stream_workflow(workflow_config: str, request: WorkflowRequest, with_totals: bool = False) -> StreamingResponse:
+    """
+    Runs a workflow on a pooled engine and streams its output as plain text.
+    With 'with_totals', the run's cost and token count are appended at the end.
+    The engine goes back to the pool once the stream is over, whether it finished or the client left.
+    """
+    engine, version = await _acquire_engine(workflow_config)
+    stream = engine.run(request.input_data, session_id=request.session_id)
+
+    async def event_stream():
+        try:
+            async for chunk in stream:
+                yield chunk
+            if with_totals:
+                yield f"\n\n[COST:${engine.context.total_cost:.6f}][TOKENS:{engine.context.total_tokens_used}]"
+        finally:
+            # Run the nodes' cleanup now, while this request still owns the engine,
+            # not later when a disconnected stream is garbage-collected.
+            await stream.aclose()
+            _release_engine(workflow_config, version, engine)
+
+    return StreamingResponse(event_stream(), media_type="text/plain")
+
 
 @app.get("/")
 def read_root():
@@ -42,22 +139,12 @@ def read_root():
 
 
 @app.post("/run")
-def run_workflow(request: WorkflowRequest):
+async def run_workflow(request: WorkflowRequest):
     try:
-        logger.info(f'Received workflow execution request | session: {request.session_id}')
-        engine = WorkflowEngine.load_from_json(request.workflow_config, session_manager=session_manager)
-        stream = engine.run(request.input_data, session_id=request.session_id)
-
-        def event_stream():
-            for chunk in stream:
-                yield chunk
-            total_cost = engine.context.get('total_cost', 0)
-            total_tokens = engine.context.get('total_tokens_used', 0)
-            yield f"[COST:${total_cost:.6f}][TOKENS:{total_tokens}]"
-
-        return StreamingResponse(event_stream() , media_type="text/plain")
+        logger.info('Received workflow execution request | session: %s', request.session_id)
+        return await _stream_workflow(request.workflow_config, request, with_totals=True)
     except Exception as e:
-        logger.error(f"Error executing workflow: {e}")
+        logger.error('Error executing workflow: %s', e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -72,7 +159,10 @@ def delete_session(session_id: str):
     if not session_id.strip():
         raise HTTPException(status_code=400)
     
-    result = session_manager.delete_session(session_id)
+    try:
+        result = session_manager.delete_session(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     if result:
         return {"message": f"Session {session_id} deleted"}
@@ -81,35 +171,20 @@ def delete_session(session_id: str):
 
 
 @app.post("/chat/portfolio")
-def chatbot(request: WorkflowRequest):
+async def chatbot(request: WorkflowRequest):
     try:
-        logger.info(f'Received portfolio chatbot request | session: {request.session_id}')
-        engine = WorkflowEngine.load_from_json("workflow_chatbot.json", session_manager=session_manager)
-        stream = engine.run(request.input_data, session_id=request.session_id)
-
-        def event_stream():
-            for chunk in stream:
-                yield chunk
-
-        return StreamingResponse(event_stream() , media_type="text/plain")
+        logger.info('Received portfolio chatbot request | session: %s', request.session_id)
+        return await _stream_workflow("workflow_chatbot.json", request)
     except Exception as e:
-        logger.error(f"Error executing workflow: {e}")
+        logger.error('Error executing workflow: %s', e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat/rafa")
-def chatbot_rafa(request: WorkflowRequest):
+async def chatbot_rafa(request: WorkflowRequest):
     try:
-        logger.info(f'Received rafa chatbot request | session: {request.session_id}')
-        engine = WorkflowEngine.load_from_json("workflow_chatbot_rafa.json", session_manager=session_manager)
-        stream = engine.run(request.input_data, session_id=request.session_id)
-
-        def event_stream():
-            for chunk in stream:
-                yield chunk
-
-        return StreamingResponse(event_stream(), media_type="text/plain")
+        logger.info('Received rafa chatbot request | session: %s', request.session_id)
+        return await _stream_workflow("workflow_chatbot_rafa.json", request)
 
     except Exception as e:
-        logger.error(f"Error executing workflow: {e}")
+        logger.error('Error executing workflow: %s', e)
         raise HTTPException(status_code=500, detail=str(e))
-
@@ -1,9 +1,18 @@
-import logging
+import asyncio
+from collections import deque
+import functools
+from dataclasses import dataclass, field, fields, MISSING
+import inspect
 import json
+import logging
 import os
+import tempfile
+import threading
 import time 
-from nodes import BaseNode, create_node_from_dict, CostPredictNode
-from session_manager import SessionManager
+import ijson
+import orjson
+from nodes import BaseNode, create_node_from_dict, CostPredictNode, NODE_REGISTRY
+from session_manager import SESSIONS
 
 
 
@@ -11,123 +20,391 @@ logger = logging.getLogger(__name__)
 
 """
 Workflow Engine Module.
-Core logic for orchestrating sequential node execution and managing 
-shared context (flow memory).
+Core logic for orchestrating node execution and managing 
+shared context (flow memory). Nodes are grouped into execution layers
+from the workflow connections; nodes in the same layer run concurrently.
 """
 
+_STREAM_END = object()
+
+# Workflow files the engine rewrote itself to persist trained weights, keyed by
+# absolute path: (mtime of that write, version the nodes were compiled from).
+_OWN_WRITES: dict[str, tuple[int, int]] = {}
+_STATE_LOCK = threading.Lock()
+
+
+def workflow_version(file_path: str) -> int:
+    """
+    Version of a workflow file, taken from its modification time.
+    Rewrites made by the engine itself keep the version they started from:
+    the cached nodes already hold the weights those writes persist, so they stay valid.
+    """
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    own = _OWN_WRITES.get(os.path.abspath(file_path))
+    if own is not None and own[0] == mtime_ns:
+        return own[1]
+    return mtime_ns
+
+
+@dataclass(slots=True)
+class WorkflowContext:
+    """
+    Shared memory for a single workflow run.
+    Well-known keys are typed slots that nodes read and write as attributes;
+    anything else a node wants to share goes into 'extras'.
+    """
+    user_input: str = ""
+    file_content: str | None = None
+    web_search: str | None = None
+    needs_ai: bool | None = None
+    skip_reader: bool = False
+    predicted_cost: float = 0.0
+    anomaly_prob: float = 0.0
+    last_message_cost: float = 0.0
+    total_cost: float = 0.0
+    total_tokens_used: int = 0
+    conversation_history: list | deque = field(default_factory=list)
+    extras: dict = field(default_factory=dict)
+
+    def clear(self) -> None:
+        """Resets every field to its default, keeping the same object."""
+        for context_field in fields(self):
+            if context_field.default_factory is not MISSING:
+                setattr(self, context_field.name, context_field.default_factory())
+            else:
+                setattr(self, context_field.name, context_field.default)
+
+    def update(self, data: dict) -> None:
+        """Loads values from a plain dict, such as a saved session. Unknown keys go to 'extras'."""
+        for key, value in data.items():
+            key = _LEGACY_CONTEXT_KEYS.get(key, key)
+            if key == 'extras':
+                self.extras.update(value)
+            elif key in _CONTEXT_FIELDS:
+                setattr(self, key, value)
+            else:
+                self.extras[key] = value
+
+    def to_dict(self) -> dict:
+        """Plain dict snapshot of the context, used for persistence."""
+        data = {name: getattr(self, name) for name in _CONTEXT_FIELD_ORDER}
+        data['conversation_history'] = list(self.conversation_history)
+        data['extras'] = dict(self.extras)
+        return data
+
+
+# Declaration order for snapshots, so saved sessions serialize identically in every process.
+_CONTEXT_FIELD_ORDER = tuple(context_field.name for context_field in fields(WorkflowContext))
+_CONTEXT_FIELDS = frozenset(_CONTEXT_FIELD_ORDER)
+_LEGACY_CONTEXT_KEYS = {'Web Search': 'web_search'}
+
+
+async def _iterate_in_thread(iterator):
+    """Pulls items from a blocking iterator in a worker thread, one at a time."""
+    iterator = iter(iterator)
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, _STREAM_END)
+        if chunk is _STREAM_END:
+            return
+        yield chunk
+
+
 class WorkflowEngine:
 
     """
     Orchestrates the execution of multiple nodes.
-    Maintains a shared 'context' dictionary that acts as a common
+    Maintains a shared WorkflowContext that acts as a common
     memory for all nodes in the pipeline.
     """ 
 
+    __slots__ = ('nodes', 'node_ids', 'connections', 'context', 'flow_name', 'session_manager', '_timing_enabled')
+
+    max_restored_messages = 20
+
     def __init__(self, session_manager=None):
         self.nodes: list[BaseNode] = []
-        self.context: dict = {}
+        self.node_ids: list[str] = []
+        self.connections: list[dict] = []
+        self.context = WorkflowContext()
         self.flow_name: str = "Unnamed Workflow"
-        self.session_manager = session_manager
+        self.session_manager = session_manager or SESSIONS
+        self._timing_enabled = logger.isEnabledFor(logging.INFO)
         
 
-    def add_node(self, node: BaseNode) -> None:
+    def reset(self) -> None:
+        """Clears per-run state so a pooled engine can serve the next request."""
+        self.context.clear()
+
+    async def warm_up(self) -> None:
+        """Lets every node open its connections ahead of the first run."""
+        await asyncio.gather(*(node.warm_up() for node in self.nodes))
+
+    def add_node(self, node: BaseNode, node_id: str = None) -> None:
+        """Appends a node, chaining it after the current last node."""
+        node_id = node_id or node.to_dict()['id']
+        if self.node_ids:
+            self.connections.append({'from': self.node_ids[-1], 'to': node_id})
         self.nodes.append(node)
+        self.node_ids.append(node_id)
 
     
-    def run(self, input_data: str, session_id: str = None):
-        self.context['user_input'] = input_data
-        current_data = input_data
-
-        for i, node in enumerate(self.nodes):
-            start_time = time.time()
-            result = node.execute(current_data, self)
-
-            if hasattr(result, "__iter__") and not isinstance(result, (list, str)):
-                collected_text = ""
-                try:
-                   for chunk in result:
-                       yield chunk
-                       collected_text += chunk
-                   current_data = collected_text
-                except Exception as e:
-                    logger.error(f"Error streaming from node {node.name}: {e}")
-                    raise e
-            else:
-                current_data = result
-                if i == len(self.nodes) - 1:
-                    yield result
-            duration = time.time() - start_time
-            logger.info(f'Node {node.name} executed in {duration:.3f}s')
+    async def run(self, input_data: str, session_id: str = None):
+        """
+        Executes the pipeline as an async generator, one layer at a time.
+        Nodes inside a layer are independent and are awaited together;
+        streamed chunks are forwarded to the caller as they arrive.
+        """
+        if session_id:
+            await self._restore_session(session_id)
+        self.context.user_input = input_data
+        predecessors = self._predecessor_map()
+        layers = self._build_layers(predecessors)
+        outputs: dict[int, str] = {}
+
+        for layer_number, layer in enumerate(layers):
+            start_time = time.perf_counter_ns() if self._timing_enabled else 0
+            inputs = [self._input_for(i, predecessors, outputs, input_data) for i in layer]
+            results = await asyncio.gather(*(self.nodes[i].aexecute(data, self) for i, data in zip(layer, inputs)))
+
+            for i, result in zip(layer, results):
+                node = self.nodes[i]
+                if inspect.isasyncgen(result) or (hasattr(result, "__iter__") and not isinstance(result, (list, str))):
+                    stream = result if inspect.isasyncgen(result) else _iterate_in_thread(result)
+                    parts = []
+                    try:
+                       async for chunk in stream:
+                           yield chunk
+                           parts.append(chunk)
+                       outputs[i] = "".join(parts)
+                    except Exception as e:
+                        logger.error('Error streaming from node %s: %s', node.name, e)
+                        raise e
+                    finally:
+                        # Closing run() early must finalize the node's stream now, not at garbage collection.
+                        await stream.aclose()
+                else:
+                    outputs[i] = result
+                    if layer_number == len(layers) - 1:
+                        yield result
+                if self._timing_enabled:
+                    logger.info('Node %s executed in %d ns', node.name, time.perf_counter_ns() - start_time)
         for node in self.nodes:
             if isinstance(node, CostPredictNode):
-               last_cost = self.context.get('last_message_cost')
+               last_cost = self.context.last_message_cost
                if last_cost:
-                   node.train(self.context['user_input'], last_cost)
-                   self._save_workflow_state()
+                   node.train(self.context.user_input, last_cost)
+                   await asyncio.to_thread(self._save_workflow_state)
 
         if session_id:
-            self.session_manager.save_history(session_id, self.context)
+            self.session_manager.save_history(session_id, self.context.to_dict())
     
+    async def _restore_session(self, session_id: str) -> None:
+        """
+        Loads the saved conversation of a session so it carries over between turns.
+        Only the conversation history and 'extras' come back; per-run fields such as
+        the input, file content and cost totals start fresh every run.
+        The history is cut to the last 'max_restored_messages', since workflows without
+        a MemoryNode would otherwise send an ever-growing conversation with every prompt.
+        """
+        saved = await self.session_manager.load_history_async(session_id)
+        if isinstance(saved, dict):
+            self.context.extras.update(saved.get('extras') or {})
+            saved = saved.get('conversation_history') or []
+        if saved:
+            self.context.conversation_history = list(saved)[-self.max_restored_messages:]
+
     def save_to_json(self, file_path: str) -> None:
         """Serializes the current workflow configuration and context to a JSON file."""
+        node_dicts = [node.to_dict() for node in self.nodes]
+        id_map = {node_id: node_dict['id'] for node_id, node_dict in zip(self.node_ids, node_dicts)}
+        connections = [{'from': id_map[c['from']], 'to': id_map[c['to']]} for c in self.connections]
+
         workflow_data = {
             'flow_name': 'Exported Workflow',
-            'nodes': [node.to_dict() for node in self.nodes],
-            'connections': self._generate_connections()
+            'nodes': node_dicts,
+            'connections': connections
         }
 
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(workflow_data, f, indent=4, ensure_ascii=False)
-        logger.info(f'Workflow saved to {file_path} successfully.')
-
-    def _generate_connections(self) -> list[dict]:
-        """Generates a list of connections between nodes based on their order."""
-        connections = []
-        node_ids = [node.to_dict()['id'] for node in self.nodes]
-        for i in range(len(self.nodes) - 1):
-            connections.append({
-                'from': node_ids[i],
-                'to': node_ids[i + 1]
-            })
-        return connections
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(workflow_data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+        logger.info('Workflow saved to %s successfully.', file_path)
+
+    @staticmethod
+    def _connections_from_ids(node_ids: list[str]) -> list[dict]:
+        """Generates a linear chain of connections following the order of the given ids."""
+        return [{'from': source, 'to': target} for source, target in zip(node_ids, node_ids[1:])]
     
-    def _save_workflow_state(self):
+    def _predecessor_map(self) -> dict[int, set[int]]:
         """
-        Upload JSON to actual node weigth
+        Maps every node index to the indices it depends on.
         """
-        try:
-            with open('workflow_example.json', 'r') as f:
-                data = json.load(f)
-            updated_node = []
-            for node in self.nodes:
-                if hasattr(node, 'to_dict'):
-                    updated_node.append(node.to_dict())
-                else:
-                    original_node = next((n for n in data['nodes'] if n ['id'] == node.id), None)
-                    if original_node:
-                        updated_node.append(original_node)
-            data['nodes'] = updated_node
+        index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        predecessors = {i: set() for i in range(len(self.nodes))}
+        for connection in self.connections:
+            predecessors[index[connection['to']]].add(index[connection['from']])
+        return predecessors
+
+    def _build_layers(self, predecessors: dict[int, set[int]]) -> list[list[int]]:
+        """
+        Groups node indices into execution layers using Kahn's algorithm.
+        Every node in a layer only depends on nodes from earlier layers.
+        """
+        remaining = {i: set(preds) for i, preds in predecessors.items()}
+        layers = []
+        while remaining:
+            layer = sorted(i for i, preds in remaining.items() if not preds)
+            if not layer:
+                raise ValueError('Workflow connections contain a cycle.')
+            layers.append(layer)
+            for i in layer:
+                del remaining[i]
+            for preds in remaining.values():
+                preds.difference_update(layer)
+        return layers
 
-            with open('workflow_example.json', 'w') as f:
-                json.dump(data, f, indent=4)
+    @staticmethod
+    def _input_for(i: int, predecessors: dict[int, set[int]], outputs: dict[int, str], input_data: str) -> str:
+        """Root nodes receive the user input; others take the output of their latest declared predecessor."""
+        if not predecessors[i]:
+            return input_data
+        return outputs[max(predecessors[i])]
 
-            logger.info(f"Workflow state persisted to workflow_example.json")
+    def _save_workflow_state(self):
+        """
+        Upload JSON to actual node weigth.
+        Runs in a worker thread; the lock keeps concurrent runs from interleaving writes.
+        """
+        try:
+            with _STATE_LOCK:
+                self._write_workflow_state('workflow_example.json')
+            logger.info("Workflow state persisted to workflow_example.json")
         
         except Exception as e:
-            logger.error(f"Error persisting workflow state: {e}")
+            logger.error('Error persisting workflow state: %s', e)
+
+    def _write_workflow_state(self, file_path: str) -> None:
+        """Rewrites the node definitions in 'file_path' and records the write as the engine's own."""
+        version = workflow_version(file_path)
+        with open(file_path, 'rb') as f:
+            data = orjson.loads(f.read())
+        updated_node = []
+        for node in self.nodes:
+            if hasattr(node, 'to_dict'):
+                updated_node.append(node.to_dict())
+            else:
+                original_node = next((n for n in data['nodes'] if n ['id'] == node.id), None)
+                if original_node:
+                    updated_node.append(original_node)
+        data['nodes'] = updated_node
+
+        # Swapped in whole, since engines being built may be parsing the file right now.
+        # Four-space indent matches the tracked file, so only the changed weights show in a diff.
+        payload = json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8') + b"\n"
+        directory, name = os.path.split(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.chmod(temp_path, os.stat(file_path).st_mode & 0o777)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        _OWN_WRITES[os.path.abspath(file_path)] = (os.stat(file_path).st_mtime_ns, version)
     
+    @staticmethod
+    def _validate(nodes: list[dict], connections: list[dict]) -> None:
+        """
+        Checks a workflow definition before any node is instantiated.
+        Raises ValueError on unknown node types, dangling or cyclic connections,
+        incompatible node schemas and missing environment secrets.
+        """
+        node_classes = {}
+        for node_data in nodes:
+            node_class = NODE_REGISTRY.get(node_data['type'])
+            if node_class is None:
+                raise ValueError(f"Unknown node type: {node_data['type']}")
+            if node_data['id'] in node_classes:
+                raise ValueError(f"Duplicate node id: {node_data['id']}")
+            node_classes[node_data['id']] = node_class
+
+        adjacency = {node_id: [] for node_id in node_classes}
+        for connection in connections:
+            source, target = connection['from'], connection['to']
+            if source not in node_classes or target not in node_classes:
+                raise ValueError(f"Connection references an unknown node: {source} -> {target}")
+            if not node_classes[target].input_schema.items() <= node_classes[source].output_schema.items():
+                raise ValueError(f"Incompatible connection: {source} output does not match {target} input")
+            adjacency[source].append(target)
+
+        WHITE, GRAY, BLACK = 0, 1, 2
+        color = dict.fromkeys(adjacency, WHITE)
+        for root in adjacency:
+            if color[root] != WHITE:
+                continue
+            color[root] = GRAY
+            stack = [(root, iter(adjacency[root]))]
+            while stack:
+                node_id, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    color[node_id] = BLACK
+                    stack.pop()
+                elif color[child] == GRAY:
+                    raise ValueError(f"Workflow connections contain a cycle: {node_id} -> {child}")
+                elif color[child] == WHITE:
+                    color[child] = GRAY
+                    stack.append((child, iter(adjacency[child])))
+
+        for node_class in set(node_classes.values()):
+            for env_name in node_class.required_env:
+                if not os.getenv(env_name):
+                    raise ValueError(f"{env_name} not found in environment variables. Please set it in the .env file.")
+
     @classmethod
     def load_from_json(cls, file_path: str, session_manager=None) -> 'WorkflowEngine':
-        """Loads a workflow configuration from a JSON file and constructs the engine."""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        """
+        Loads a workflow configuration from a JSON file and constructs the engine.
+        The parsed and validated node graph is cached per file version, so only
+        the per-request state (context) is new on each call.
+        """
+        flow_name, nodes, node_ids, connections = _load_compiled(file_path, workflow_version(file_path))
 
         engine = cls(session_manager=session_manager)
-        engine.flow_name = data.get('flow_name', 'Unnamed Workflow')
-       
-        for node_data in data['nodes']:
-            node = create_node_from_dict(node_data)
-            engine.add_node(node)
-
-        logger.info(f'Workflow loaded from {file_path} successfully.')
-        return engine
\ No newline at end of file
+        engine.flow_name = flow_name
+        engine.connections = list(connections)
+        engine.nodes = list(nodes)
+        engine.node_ids = list(node_ids)
+
+        logger.info('Workflow loaded from %s successfully.', file_path)
+        return engine
+
+
+@functools.lru_cache(maxsize=32)
+def _load_compiled(file_path: str, version: int) -> tuple:
+    """
+    Parses, validates and instantiates the nodes of a workflow file.
+    Keyed by workflow_version so edits to the file are picked up on the next load.
+    Nodes keep no per-request state, so the instances are shared between engines.
+
+    The file is parsed incrementally with ijson: node definitions (which may carry
+    large prompts) are read one at a time, so only one of them is in memory at once.
+    """
+    with open(file_path, 'rb') as f:
+        flow_name = next(ijson.items(f, 'flow_name'), 'Unnamed Workflow')
+        f.seek(0)
+        headers = [{'id': node_data['id'], 'type': node_data['type']} for node_data in ijson.items(f, 'nodes.item')]
+        f.seek(0)
+        connections = tuple(ijson.items(f, 'connections.item'))
+
+        WorkflowEngine._validate(headers, connections)
+
+        f.seek(0)
+        nodes = tuple(create_node_from_dict(node_data) for node_data in ijson.items(f, 'nodes.item', use_float=True))
+
+    node_ids = tuple(header['id'] for header in headers)
+    if not connections:
+        connections = tuple(WorkflowEngine._connections_from_ids(node_ids))
+    return flow_name, nodes, node_ids, connections
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 from dotenv import load_dotenv
@@ -24,6 +25,11 @@ Configures and executes the AI Portfolio Assistant workflow.
 """
 
 
+async def collect(stream) -> str:
+    """Drains the engine's async stream into a single string."""
+    return "".join([chunk async for chunk in stream])
+
+
 if __name__ == "__main__":
 
     # Initialize the engine and define the intelligent pipeline
@@ -31,7 +37,7 @@ if __name__ == "__main__":
     engine = WorkflowEngine.load_from_json("workflow_example.json")
 
     question = "Can you provide a brief summary of Carlos's professional background?"
-    answer = engine.run(question)
+    answer = asyncio.run(collect(engine.run(question)))
     print("AI Response (loaded from JSON):", answer)
     engine.save_to_json("current_workflow.json")
 
@@ -1,10 +1,20 @@
+import asyncio
+import functools
+import hashlib
+import inspect
 import os
 import logging
-import requests
-from openai import OpenAI
+import mmap
+import string
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from openai import AsyncOpenAI
 from typing import TYPE_CHECKING
 import tiktoken 
 import numpy as np
+import orjson
 from train_security import SUSPICIOUS_KEYWORDS, special_chars
 
 if TYPE_CHECKING:
@@ -19,6 +29,70 @@ Each node performs a specific task and can interact with the global engine conte
 """
 
 
+NODE_REGISTRY: dict[str, type['BaseNode']] = {}
+
+_HTTP_CLIENT: httpx.AsyncClient | None = None
+# Blocking node work (file reads, CPU-bound transforms) runs here, apart from the
+# default executor, so it never queues behind session I/O and vice versa.
+_NODE_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="node")
+_OPENAI_CLIENTS: dict[tuple[str | None, str], AsyncOpenAI] = {}
+
+
+def _shared_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide HTTP/2 client for outbound calls.
+    LLM and web search nodes go through it, so concurrent requests multiplex over one pool of connections.
+    """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=60.0,
+        )
+    return _HTTP_CLIENT
+
+
+def _openai_client(api_key: str, base_url: str | None = None) -> AsyncOpenAI:
+    """Returns the AsyncOpenAI client for this endpoint and key, creating it on first use."""
+    key = (base_url, api_key)
+    client = _OPENAI_CLIENTS.get(key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=_shared_http_client())
+        _OPENAI_CLIENTS[key] = client
+    return client
+
+
+async def close_shared_clients() -> None:
+    """Closes the shared HTTP client; nodes pick up new clients on their next call."""
+    global _HTTP_CLIENT
+    _OPENAI_CLIENTS.clear()
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+@functools.lru_cache(maxsize=16)
+def _encoding_for(model: str) -> tiktoken.Encoding:
+    """Tokenizer for 'model', built once per process. Unknown models fall back to cl100k_base."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _readable_name(node_id: str) -> str:
+    """Turns a workflow node id such as 'web_search' into a display name ('Web Search')."""
+    return node_id.replace("_", " ").title()
+
+
+@functools.lru_cache(maxsize=None)
+def _init_params(node_class: type) -> frozenset[str]:
+    """Names of the keyword parameters a node's constructor takes besides 'name'."""
+    parameters = inspect.signature(node_class).parameters
+    return frozenset(parameters) - {'name'}
+
+
 class BaseNode:
 
     """
@@ -26,11 +100,54 @@ class BaseNode:
     Defines the contract that every node must follow.
     """
 
+    __slots__ = ('name',)
+
+    required_env: tuple[str, ...] = ()
+    input_schema: dict = {'text': 'str'}
+    output_schema: dict = {'text': 'str'}
+
     def __init__(self, name: str):
         self.name = name
+
+    @staticmethod
+    def register(node_type: str):
+        """Class decorator that makes a node available to workflow files under 'node_type'."""
+        def decorator(node_class: type['BaseNode']) -> type['BaseNode']:
+            NODE_REGISTRY[node_type] = node_class
+            return node_class
+        return decorator
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BaseNode':
+        """
+        Builds the node from its workflow definition, passing the 'params' that
+        the constructor accepts. Nodes that need anything else override this.
+        """
+        accepted = _init_params(cls)
+        params = data.get('params', {})
+        unknown = params.keys() - accepted
+        if unknown:
+            logger.warning('Ignoring unknown params for %s: %s', cls.__name__, ', '.join(sorted(unknown)))
+        return cls(name=_readable_name(data['id']), **{key: value for key, value in params.items() if key in accepted})
     
     def execute(self, input_data: str, engine: 'WorkflowEngine'):
         raise NotImplementedError('Each node must implement the execute method.')
+
+    async def aexecute(self, input_data: str, engine: 'WorkflowEngine'):
+        """
+        Async entry point used by the engine.
+        Awaits coroutine nodes, hands async generators back for streaming,
+        and runs blocking execute methods in a worker thread.
+        """
+        if inspect.isasyncgenfunction(self.execute):
+            return self.execute(input_data, engine)
+        if inspect.iscoroutinefunction(self.execute):
+            return await self.execute(input_data, engine)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_NODE_EXECUTOR, self.execute, input_data, engine)
+
+    async def warm_up(self) -> None:
+        """Opens connections ahead of the first request. No-op by default."""
     
     def to_dict(self):
         return {
@@ -40,25 +157,37 @@ class BaseNode:
         }
 
 
+@BaseNode.register('UppercaseNode')
 class UppercaseNode(BaseNode):
 
+    __slots__ = ()
+
     def execute(self, input_data: str, engine: 'WorkflowEngine'):
-        logger.info(f'Executing node {self.name} to convert to uppercase.')
+        logger.info('Executing node %s to convert to uppercase.', self.name)
         return input_data.upper()  
     
+@BaseNode.register('ReverseNode')
 class ReverseNode(BaseNode):
 
+    __slots__ = ()
+
     def execute(self, input_data: str, engine: 'WorkflowEngine'):
-        logger.info(f'Executing node {self.name} to reverse the string.')
+        logger.info('Executing node %s to reverse the string.', self.name)
         return input_data[::-1]
 
+@BaseNode.register('TrimNode')
 class TrimNode(BaseNode):
 
+    __slots__ = ()
+
     def execute(self, input_data: str, engine: 'WorkflowEngine'):
-        logger.info(f'Executing node {self.name} to trim whitespace.')
+        logger.info('Executing node %s to trim whitespace.', self.name)
         return input_data.strip()
 
+@BaseNode.register('ReplaceNode')
 class ReplaceNode(BaseNode):
+
+    __slots__ = ('old', 'new')
     
     def __init__(self, name: str, old: str, new: str):
         super().__init__(name)
@@ -66,7 +195,7 @@ class ReplaceNode(BaseNode):
         self.new = new
 
     def execute(self, input_data: str, engine: 'WorkflowEngine') -> str:
-        logger.info(f'Executing node {self.name} to replace "{self.old}" with "{self.new}".')
+        logger.info('Executing node %s to replace "%s" with "%s".', self.name, self.old, self.new)
         return input_data.replace(self.old, self.new)
     
     def to_dict(self) -> dict:
@@ -77,31 +206,46 @@ class ReplaceNode(BaseNode):
         }
         return data
 
+@BaseNode.register('FileReadNode')
 class FileReadNode(BaseNode):
 
+    __slots__ = ('file_path',)
+
     def __init__(self, name: str, file_path: str):
         super().__init__(name)
         self.file_path = file_path
-    
+
     def execute(self, input_data: str, engine: 'WorkflowEngine') -> str:
-        logger.info(f'Executing node {self.name} to read from file: {self.file_path}.')
+        logger.info('Executing node %s to read from file: %s.', self.name, self.file_path)
 
-        if engine.context.get('skip_reader'):
-           logger.info(f'Skipping FileReadNode, context already loaded')
+        if engine.context.skip_reader:
+           logger.info('Skipping FileReadNode, context already loaded')
            return input_data
 
         try:
-            with open(self.file_path, 'r', encoding= "utf-8") as file:
-                content = file.read()
-                engine.context['file_content'] = content
+            st = os.stat(self.file_path)
+            engine.context.file_content = _cached_text(self.file_path, st.st_mtime_ns, st.st_size)
             return input_data
         except FileNotFoundError:
-            logger.error(f'File not found: {self.file_path}.')
+            logger.error('File not found: %s.', self.file_path)
             return(f'File not found: {self.file_path}.')
         except Exception as e:
-            logger.error(f'An error occurred while reading the file: {e}.')
+            logger.error('An error occurred while reading the file: %s.', e)
             return(f'An error occurred while reading the file: {e}')
     
+    @staticmethod
+    def _read_text(file_path: str) -> str:
+        """
+        Decodes the file straight out of a read-only memory map, so the page cache
+        backs the bytes and only the final str is allocated.
+        """
+        with open(file_path, 'rb') as file:
+            # Empty files cannot be mapped.
+            if os.fstat(file.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return str(mapped, "utf-8")
+
     def to_dict(self) -> dict:
         data = super().to_dict()
         data['params'] = {
@@ -109,24 +253,42 @@ class FileReadNode(BaseNode):
         }
         return data
     
+@functools.lru_cache(maxsize=32)
+def _cached_text(file_path: str, mtime_ns: int, size: int) -> str:
+    """
+    Decoded contents of a context file. Keyed on mtime and size, so editing
+    the file produces a new entry and stale text ages out of the LRU.
+    """
+    return FileReadNode._read_text(file_path)
+
+
+@BaseNode.register('MemoryNode')
 class MemoryNode(BaseNode):
     """
     Manages conversation history by storing and retrieving past interactions.
     Limits the history to the most recent 'max_turns' exchanges to optimize token usage.
+    The history becomes a bounded deque, so later appends drop the oldest message on their own.
     Does not modify input_data; acts as a memory layer for downstream nodes (e.g., LLMNode).
     """
 
+    __slots__ = ('max_turns',)
+
     def __init__(self, name: str, max_turns: int = 5):
         super().__init__(name)
         self.max_turns = max_turns
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MemoryNode':
+        return cls(name=data['id'], max_turns=data.get('params', {}).get('max_turns', 5))
+
     def execute(self, input_data: str, engine: 'WorkflowEngine') -> str:
-        logger.info(f'Executing node {self.name} for keep the information in conversation memory')
-        history = engine.context.get('conversation_history', [])
+        logger.info('Executing node %s for keep the information in conversation memory', self.name)
+        history = engine.context.conversation_history
         num_msg = self.max_turns * 2
-        if len(history) > num_msg:
-         engine.context['conversation_history'] = history[-num_msg:]
-         logger.info(f'Memory trimmed to last {self.max_turns} turns ({num_msg} messages)')
+        if not (isinstance(history, deque) and history.maxlen == num_msg):
+            if len(history) > num_msg:
+                logger.info('Memory trimmed to last %d turns (%d messages)', self.max_turns, num_msg)
+            engine.context.conversation_history = deque(history, maxlen=num_msg)
         return input_data
    
     def to_dict(self) -> dict:
@@ -142,14 +304,49 @@ class MemoryNode(BaseNode):
         
 
 
+@functools.lru_cache(maxsize=64)
+def _system_content(system_prompt: str, context_info: str, web_context: str, model: str, budget: int) -> str:
+    """
+    Assembles the system message once per distinct context instead of on every turn.
+    The file context is cut to 'budget' tokens so a large knowledge base cannot blow up the prompt.
+    """
+    # A token spans at least one character, so short texts never need encoding.
+    if len(context_info) > budget:
+        enc = _encoding_for(model)
+        tokens = enc.encode(context_info)
+        if len(tokens) > budget:
+            context_info = enc.decode(tokens[:budget])
+    return f"{system_prompt}\n\n--- CONTEXTO DESDE ARCHIVO ---\n{context_info}\n\n---CONTEXTO DESDE WEB---\n{web_context}"
+
+
+class _AbandonedRequest(RuntimeError):
+    """The in-flight LLM request other nodes were waiting on stopped before finishing."""
+
+
+@BaseNode.register('LLMNode')
 class LLMNode(BaseNode):
 
     """
     AI Processing Node.
     Connects to Abacus RouteLLM to process text. It dynamically injects 
     context from the engine's shared memory into the system prompt.
+    Tokens are streamed back as an async generator as soon as they arrive.
+    API failures are streamed back as an '[error] ...' chunk instead of raising.
+    With temperature 0 the answer is deterministic, so concurrent identical
+    requests share a single API call instead of each paying for one.
+    Finished answers are cached by a hash of the model, temperature and full
+    prompt, so repeated questions with the same context skip the API entirely.
     """
 
+    __slots__ = ('model', 'system_prompt', 'temperature', '_api_key', '_base_url')
+
+    required_env = ('ROUTELLM_API_KEY',)
+    _inflight: dict[bytes, asyncio.Future] = {}
+    _responses: OrderedDict[bytes, str] = OrderedDict()
+    max_cached_responses = 256
+    cache_max_temperature = 0.7
+    context_token_budget = 6000
+
     def __init__(self, name: str, model: str, system_prompt: str, temperature: float = 0.4):
         super().__init__(name)
         self.model = model
@@ -160,58 +357,230 @@ class LLMNode(BaseNode):
         if not api_key:
             raise ValueError("ROUTELLM_API_KEY not found in environment variables. Please set it in the .env file.")
         
-        self.client = OpenAI(api_key=api_key)
+        self._api_key = api_key
+        self._base_url = os.getenv("OPENAI_BASE_URL")
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """
+        The shared client for this node's endpoint, looked up on every use.
+        Nodes outlive close_shared_clients (they are cached with their workflow),
+        so holding on to a client would leave them with a closed connection pool.
+        """
+        return _openai_client(self._api_key, self._base_url)
+
+    async def warm_up(self) -> None:
+        """Makes a cheap authenticated call so DNS, TLS and HTTP/2 are set up before real traffic."""
+        try:
+            await self.client.models.list()
+        except Exception as e:
+            logger.warning('Warm-up call for node %s failed: %s', self.name, e)
         
-    def execute(self, input_data: str, engine: 'WorkflowEngine'):
-        if engine.context.get('needs_ai') == False:
+    async def execute(self, input_data: str, engine: 'WorkflowEngine'):
+        if engine.context.needs_ai is False:
            yield input_data
            return
         
-        context_info = engine.context.get('file_content', 'No hay información adicional disponible.')
-        web_context = engine.context.get('Web Search', 'No encontrada busqueda' )
-        
-        logger.info(f'Executing node {self.name} with multi-source context (file + web).')
-
-        acumulate_text = ""
-        messages = [
-                    {"role": "system", "content": f"{self.system_prompt}\n\n--- CONTEXTO DESDE ARCHIVO ---\n{context_info}\n\n---CONTEXTO DESDE WEB---\n{web_context}"},
-                    *engine.context.get('conversation_history', []),
-                    {"role": "user", "content": f"Pregunta: {input_data}"},
-                ]
+        logger.info('Executing node %s with multi-source context (file + web).', self.name)
+
+        parts: list[str] = []
+        messages = self._build_messages(input_data, engine)
+
+        key = hashlib.blake2b(orjson.dumps(messages) + f"|{self.model}|{self.temperature}".encode(), digest_size=16).digest()
+        cacheable = self.temperature <= self.cache_max_temperature
+        if cacheable and key in LLMNode._responses:
+            LLMNode._responses.move_to_end(key)
+            answer = LLMNode._responses[key]
+            logger.info('Node %s answered from the response cache', self.name)
+            yield answer
+            self._record_turn(engine, input_data, answer)
+            return
+
+        coalesce = self.temperature == 0
+        if coalesce:
+            # When the request being waited on is abandoned, the first waiter to wake up
+            # makes the call itself and the others join it.
+            while (pending := LLMNode._inflight.get(key)) is not None:
+                logger.info('Node %s joined an identical in-flight request', self.name)
+                try:
+                    answer = await asyncio.shield(pending)
+                except _AbandonedRequest:
+                    continue
+                except Exception as e:
+                    yield f"[error] {e}"
+                    return
+                yield answer
+                self._record_turn(engine, input_data, answer)
+                return
+            future = asyncio.get_running_loop().create_future()
+            LLMNode._inflight[key] = future
         
+        usage = None
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 stream= True,
                 messages= messages,
-                temperature=self.temperature
+                temperature=self.temperature,
+                stream_options={"include_usage": True},
             )
-            for chunck in response:
+            async for chunck in response:
+                if chunck.usage is not None:
+                    usage = chunck.usage
+                if not chunck.choices:
+                    continue
                 content = chunck.choices[0].delta.content
                 if content:
                     yield content
-                    acumulate_text += content
-
-            enc = tiktoken.encoding_for_model(self.model)
-            full_input = " ".join([m["content"] for m in messages])
-            input_tokens = len(enc.encode(full_input))
-            output_tokens = len(enc.encode(acumulate_text))
-            total_tokens = input_tokens + output_tokens
-            cost = (input_tokens * 0.15 / 1_000_000) + (output_tokens * 0.60 / 1_000_000)
-            logger.info(f'Node {self.name} used {total_tokens} tokens (In: {input_tokens}, Out: {output_tokens} ) | Cost: ${cost:.6f}')
-            previous_tokens = engine.context.get('total_tokens_used', 0)
-            engine.context['total_tokens_used'] = previous_tokens + total_tokens
-            previous_cost = engine.context.get('total_cost', 0)
-            engine.context['total_cost'] = previous_cost + cost
-            engine.context['last_message_cost'] = cost
-            history = engine.context.get('conversation_history', [])
-            history.append({"role": "user", "content": input_data})
-            history.append({"role": "assistant", "content": acumulate_text})
-            engine.context['conversation_history'] = history
+                    parts.append(content)
+
+            if cacheable:
+                self._cache_response(key, "".join(parts))
+            if coalesce:
+                future.set_result("".join(parts))
             
         except Exception as e:
-            logger.error(f'An error occurred while processing with LLM: {e}.')
-            raise e
+            logger.error('An error occurred while processing with LLM: %s.', e)
+            if coalesce and not future.done():
+                future.set_exception(e)
+                # Mark it as retrieved; requests waiting on it report it themselves.
+                future.exception()
+            yield f"[error] {e}"
+
+        finally:
+            # Runs on success, on error and when the consumer stops early,
+            # so whatever was streamed is always billed and remembered.
+            if parts:
+                self._finalize(engine, messages, input_data, "".join(parts), usage)
+            if coalesce:
+                if not future.done():
+                    future.set_exception(_AbandonedRequest('Identical LLM request was abandoned before finishing.'))
+                    future.exception()
+                LLMNode._inflight.pop(key, None)
+
+    def _cache_response(self, key: bytes, answer: str) -> None:
+        """Remembers a finished answer, evicting the least recently used ones past the limit."""
+        LLMNode._responses[key] = answer
+        LLMNode._responses.move_to_end(key)
+        while len(LLMNode._responses) > self.max_cached_responses:
+            LLMNode._responses.popitem(last=False)
+
+    def _build_messages(self, input_data: str, engine: 'WorkflowEngine') -> list[dict]:
+        """Builds the chat messages: system prompt with file and web context, past turns, then the question."""
+        context_info = engine.context.file_content
+        if context_info is None:
+            context_info = 'No hay información adicional disponible.'
+        web_context = engine.context.web_search
+        if web_context is None:
+            web_context = 'No encontrada busqueda'
+
+        system_content = _system_content(self.system_prompt, context_info, web_context, self.model, self.context_token_budget)
+        return [
+                    {"role": "system", "content": system_content},
+                    *engine.context.conversation_history,
+                    {"role": "user", "content": f"Pregunta: {input_data}"},
+                ]
+
+    async def execute_batch(self, inputs: list[str], engine: 'WorkflowEngine', poll_interval: float = 30.0, max_wait: float = 24 * 3600.0) -> list[str]:
+        """
+        Answers many independent questions at once, for offline jobs such as replaying
+        a session log or evaluating prompt variants.
+        Requests go through the Batch API, which costs half as much as live calls but
+        may take up to 24h. A single question is sent as one regular call instead.
+        A batch still running after 'max_wait' seconds is cancelled.
+        Every question sees the current context; the conversation history is not updated.
+        Failed requests come back as '[error] ...' strings, in input order.
+        """
+        if not inputs:
+            return []
+        bodies = [
+            {"model": self.model, "messages": self._build_messages(text, engine), "temperature": self.temperature}
+            for text in inputs
+        ]
+        if len(bodies) == 1:
+            try:
+                response = await self.client.chat.completions.create(**bodies[0])
+            except Exception as e:
+                logger.error('An error occurred while processing with LLM: %s.', e)
+                return [f"[error] {e}"]
+            answer = response.choices[0].message.content or ""
+            self._add_cost(engine, *self._token_counts(bodies[0]["messages"], answer, response.usage))
+            return [answer]
+
+        lines = b"".join(
+            orjson.dumps({"custom_id": str(idx), "method": "POST", "url": "/v1/chat/completions", "body": body}, option=orjson.OPT_APPEND_NEWLINE)
+            for idx, body in enumerate(bodies)
+        )
+        upload = await self.client.files.create(file=("batch.jsonl", lines), purpose="batch")
+        batch = await self.client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h")
+        logger.info('Node %s submitted batch %s with %d requests', self.name, batch.id, len(bodies))
+
+        deadline = time.monotonic() + max_wait
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error('Batch %s still %s after %.0f s, cancelling it', batch.id, batch.status, max_wait)
+                try:
+                    await self.client.batches.cancel(batch.id)
+                except Exception as e:
+                    logger.warning('Could not cancel batch %s: %s', batch.id, e)
+                return [f"[error] Batch did not finish within {max_wait:.0f} s."] * len(bodies)
+            await asyncio.sleep(min(poll_interval, remaining))
+            batch = await self.client.batches.retrieve(batch.id)
+
+        answers = ["[error] No result returned by the batch."] * len(bodies)
+        if batch.output_file_id is None and batch.error_file_id is None:
+            logger.error('Batch %s ended with status %s and no output', batch.id, batch.status)
+            return answers
+
+        # Successful requests land in the output file and failed ones in the error file.
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            output = await self.client.files.content(file_id)
+            for line in output.content.splitlines():
+                record = orjson.loads(line)
+                idx = int(record["custom_id"])
+                body = (record.get("response") or {}).get("body") or {}
+                if record.get("error") or not body.get("choices"):
+                    answers[idx] = f"[error] {record.get('error') or body.get('error')}"
+                    continue
+                answers[idx] = body["choices"][0]["message"]["content"] or ""
+                usage = body.get("usage") or {}
+                self._add_cost(engine, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), rate=0.5)
+        return answers
+
+    def _finalize(self, engine: 'WorkflowEngine', messages: list[dict], input_data: str, answer: str, usage=None) -> None:
+        """
+        Adds the cost of a finished (or interrupted) reply and records the turn.
+        Token counts come from the usage chunk the API sends last; only a stream
+        cut short before it arrived is tokenized locally.
+        """
+        self._add_cost(engine, *self._token_counts(messages, answer, usage))
+        self._record_turn(engine, input_data, answer)
+
+    def _token_counts(self, messages: list[dict], answer: str, usage=None) -> tuple[int, int]:
+        """Input and output tokens of a call, from the API's usage when it sent one, else tokenized locally."""
+        if usage is not None:
+            return usage.prompt_tokens, usage.completion_tokens
+        enc = _encoding_for(self.model)
+        return len(enc.encode(" ".join([m["content"] for m in messages]))), len(enc.encode(answer))
+
+    def _add_cost(self, engine: 'WorkflowEngine', input_tokens: int, output_tokens: int, rate: float = 1.0) -> None:
+        """Adds a call's tokens and cost to the context totals. 'rate' scales the price, e.g. 0.5 for batches."""
+        total_tokens = input_tokens + output_tokens
+        cost = ((input_tokens * 0.15 / 1_000_000) + (output_tokens * 0.60 / 1_000_000)) * rate
+        logger.info('Node %s used %d tokens (In: %d, Out: %d ) | Cost: $%.6f', self.name, total_tokens, input_tokens, output_tokens, cost)
+        engine.context.total_tokens_used += total_tokens
+        engine.context.total_cost += cost
+        engine.context.last_message_cost = cost
+
+    @staticmethod
+    def _record_turn(engine: 'WorkflowEngine', input_data: str, answer: str) -> None:
+        """Appends the question and its answer to the conversation history."""
+        history = engine.context.conversation_history
+        history.append({"role": "user", "content": input_data})
+        history.append({"role": "assistant", "content": answer})
         
     def to_dict(self) -> dict:
        data = super().to_dict()
@@ -223,8 +592,13 @@ class LLMNode(BaseNode):
        return data
     
 
+@BaseNode.register('WebSearchNode')
 class WebSearchNode(BaseNode):
 
+    __slots__ = ('query_prefix', 'max_results', 'api_key', 'base_url')
+
+    required_env = ('TAVILY_API_KEY',)
+
     def __init__(self, name:str, query_prefix: str = "", max_results: int = 5):
         super().__init__(name)
         self.query_prefix = query_prefix
@@ -237,9 +611,9 @@ class WebSearchNode(BaseNode):
         self.api_key = api_key
         self.base_url = "https://api.tavily.com/search"
 
-    def execute(self, input_data: str, engine: 'WorkflowEngine') -> str:
+    async def execute(self, input_data: str, engine: 'WorkflowEngine') -> str:
         query = f"{self.query_prefix} {input_data}".strip()
-        logger.info(f'Executing node {self.name} to perform web search with query: {query}')
+        logger.info('Executing node %s to perform web search with query: %s', self.name, query)
         payload = {
             "query": query,
             "max_results": self.max_results,
@@ -250,7 +624,7 @@ class WebSearchNode(BaseNode):
             "Content-Type": "application/json"
         }
         try:
-            response = requests.post(self.base_url,json=payload, headers=headers, timeout=10)
+            response = await _shared_http_client().post(self.base_url, json=payload, headers=headers, timeout=10)
             response.raise_for_status()
             data = response.json()
             results = data.get("results", [])
@@ -269,14 +643,14 @@ class WebSearchNode(BaseNode):
 
             formatted_results = "\n".join(snippets) if snippets else "No results found."
 
-            engine.context['Web Search'] = formatted_results
+            engine.context.web_search = formatted_results
 
             return input_data
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Error during web search: {e}.')
-            if e.response is not None:
-                 logger.error(f'Response status: {e.response.status_code}, body: {e.response.text}')
-            engine.context["Web Search"] = f"Error during web search: {e}"
+        except httpx.HTTPError as e:
+            logger.error('Error during web search: %s.', e)
+            if isinstance(e, httpx.HTTPStatusError):
+                 logger.error('Response status: %s, body: %s', e.response.status_code, e.response.text)
+            engine.context.web_search = f"Error during web search: {e}"
             return input_data
         
     def to_dict(self) -> dict:
@@ -288,6 +662,7 @@ class WebSearchNode(BaseNode):
         return data
     
 
+@BaseNode.register('CostPredictNode')
 class CostPredictNode(BaseNode):
     """
     CostPredictNode
@@ -302,12 +677,27 @@ class CostPredictNode(BaseNode):
     This node currently performs inference only (no training / gradient descent yet).
     """
 
+    __slots__ = ('id', 'w', 'b')
+
     def __init__(self, name, w, b ):
         super().__init__(name)
         self.id = name
         self.w = np.array(w).reshape(2, 1)
         self.b = float(b)
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CostPredictNode':
+        params = data.get('params', {})
+        return cls(name=_readable_name(data['id']), w=params.get('w', [0.0, 0.0]), b=params.get('b', 0.0))
+
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data['params'] = {
+            'w': self.w.flatten().tolist(),
+            'b': np.asarray(self.b).item()
+        }
+        return data
+
     def _get_features(self, input_data):
         words = input_data.split()
         x1 = len(words) / 500.0
@@ -315,11 +705,11 @@ class CostPredictNode(BaseNode):
         return np.array([[x1, x2]])
 
     def execute(self, input_data, engine: 'WorkflowEngine'):
-        logger.info(f'Executing node {self.name} to predirct the cost')
+        logger.info('Executing node %s to predirct the cost', self.name)
         x = self._get_features(input_data)
         f = np.dot(x, self.w) + self.b
 
-        engine.context['predicted_cost'] = float(f)
+        engine.context.predicted_cost = float(f)
         return input_data
         
     
@@ -331,10 +721,14 @@ class CostPredictNode(BaseNode):
         dj_db = error
         self.w = self.w - alpha * dj_dw
         self.b = self.b - alpha * dj_db
-        logger.info(f'Node {self.name} trained | error: {float(error):.4f} | w: {self.w.flatten()} | b: {float(self.b):.4f}')
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('Node %s trained | error: %.4f | w: %s | b: %.4f', self.name, float(error), self.w.flatten(), float(self.b))
 
 
 class AnomalyDetectorNode(BaseNode):
+
+    __slots__ = ('id', 'threshold', 'W1', 'b1', 'W2', 'b2')
+
     def __init__(self, name, threshold):
         super().__init__(name)
         self.id = name
@@ -369,14 +763,15 @@ class AnomalyDetectorNode(BaseNode):
         x = self._get_features(input_data)
         Z1, A1, Z2, A2 = self._forward(x)
         prob = float(A2)
-        engine.context['anomaly_prob'] = prob
-        logger.info(f"Node {self.name} | Anomaly prob: {prob:.4f} | Threshold: {self.threshold}")
+        engine.context.anomaly_prob = prob
+        logger.info("Node %s | Anomaly prob: %.4f | Threshold: %s", self.name, prob, self.threshold)
         if prob > self.threshold:
             raise ValueError(f'Security Anomaly Detected: Request Bloqued')
         else:
             return input_data
 
 
+@BaseNode.register('RouterNode')
 class RouterNode(BaseNode):
 
     """
@@ -385,74 +780,56 @@ class RouterNode(BaseNode):
     if it can be resolved with a static response, optimizing API credit usage.
     """
 
+    __slots__ = ('greetings', '_greeting_words', '_greeting_phrases', '_normalize')
+
     def __init__(self, name: str):
         super().__init__(name)
         self.greetings = ["hello", "hi", "hey", "greetings", "quien eres", "who are you"]
+        # Single words are matched by hash lookup on the input's words, so "hi" never matches "this";
+        # the few multi-word greetings are matched on word boundaries in the normalized text.
+        self._greeting_words = frozenset(greet for greet in self.greetings if " " not in greet)
+        self._greeting_phrases = tuple(f" {greet} " for greet in self.greetings if " " in greet)
+        # Punctuation (including '¿' and '¡') becomes spaces and accents are dropped in one
+        # C-level pass, so '¿Quién eres?' normalizes to the same words as 'quien eres'.
+        self._normalize = str.maketrans({
+            **{mark: " " for mark in string.punctuation + "¿¡"},
+            **dict(zip("áéíóúÁÉÍÓÚ", "aeiouAEIOU")),
+        })
+
+    def _is_greeting(self, input_data: str) -> bool:
+        words = input_data.translate(self._normalize).casefold().split()
+        if not self._greeting_words.isdisjoint(words):
+            return True
+        text = f" {' '.join(words)} "
+        return any(phrase in text for phrase in self._greeting_phrases)
 
     def execute(self, input_data: str, engine: 'WorkflowEngine') -> str:
-        logger.info(f'Executing node {self.name} to route based on input.')
-        clean_input = input_data.lower().strip()
-        history = engine.context.get('conversation_history', [])
+        logger.info('Executing node %s to route based on input.', self.name)
+        history = engine.context.conversation_history
 
 
-        if any(greet in clean_input for greet in self.greetings):
-            engine.context['needs_ai'] = False
+        if self._is_greeting(input_data):
+            engine.context.needs_ai = False
             return f"Hello! I'm Carlos virtual assistant. ¿How can I assist you today?"
         
         elif len(history) > 0:
-            logger.info(f"Existing session detected, routing directly to LlMNode")
-            engine.context['needs_ai'] = True
-            engine.context['skip_reader'] = True
+            logger.info("Existing session detected, routing directly to LlMNode")
+            engine.context.needs_ai = True
+            engine.context.skip_reader = True
             return input_data
         
         else:
-            logger.info(f"New session detected, routing to ReaderNode")
-            engine.context['needs_ai'] = True
-            engine.context['skip_reader'] = False
+            logger.info("New session detected, routing to ReaderNode")
+            engine.context.needs_ai = True
+            engine.context.skip_reader = False
             return input_data
     
 
 def create_node_from_dict(data: dict) -> BaseNode:
     node_type = data['type']
-    node_id = data['id']
-    params = data.get('params', {})
-
-    node_classes = {
-        'UppercaseNode': UppercaseNode,
-        'ReverseNode': ReverseNode,
-        'TrimNode': TrimNode,
-        'ReplaceNode': ReplaceNode,
-        'FileReadNode': FileReadNode,
-        'LLMNode': LLMNode,
-        'RouterNode': RouterNode,
-        'WebSearchNode': WebSearchNode,
-        'MemoryNode': MemoryNode,
-        'CostPredictNode': CostPredictNode
-    }
-
-    if node_type not in node_classes:
-        raise ValueError(f"Unknown node type: {node_type}")
-    
-    readable_name = node_id.replace("_", " ").title()
-    
-    if node_type in ['ReplaceNode', 'LLMNode', 'FileReadNode', 'WebSearchNode']:
-        return node_classes[node_type](name=readable_name, **params)
-    elif node_type == 'MemoryNode':
-        return MemoryNode(
-            name=node_id,
-            max_turns=params.get('max_turns', 5)
-        )
-    elif node_type == 'CostPredictNode':
-        return CostPredictNode(
-            name=readable_name,
-            w=params.get('w',[0.0, 0.0]),
-            b=params.get('b', 0.0)
-        )
-    else:
-        return node_classes[node_type](name=readable_name)
-    
-
-
+    node_class = NODE_REGISTRY.get(node_type)
 
+    if node_class is None:
+        raise ValueError(f"Unknown node type: {node_type}")
 
-   
\ No newline at end of file
+    return node_class.from_dict(data)
@@ -1,70 +1,619 @@
+import asyncio
+import atexit
+import functools
+import hashlib
 import logging
-import json
 import os
-from datetime import datetime
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from json import JSONDecodeError
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        # Non-string keys are stringified, matching the stdlib fallback below.
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    _loads = json.loads
+
+
+def _dumps_snapshot(obj) -> bytes:
+    """
+    Serializes a session snapshot, indented when SESSION_PRETTY_JSON is set so the
+    files can be read by hand while debugging. Journal lines are always compact.
+    """
+    if not os.getenv("SESSION_PRETTY_JSON"):
+        return _dumps(obj)
+    import json
+    return json.dumps(obj, ensure_ascii=False, indent=4, default=str).encode("utf-8") + b"\n"
+
+
+def _read_bytes(path: str) -> bytes:
+    """
+    Reads a whole file with one sized os.read, skipping the buffered file object.
+    Asking for one byte more than the file size means a short read already
+    proves EOF; only a file that grew meanwhile needs more reads.
+    """
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        size = os.fstat(fd).st_size + 1
+        data = os.read(fd, size)
+        if len(data) < size:
+            return data
+        chunks = [data]
+        while chunk := os.read(fd, 65536):
+            chunks.append(chunk)
+        return b"".join(chunks)
+    finally:
+        os.close(fd)
+
+
+@functools.lru_cache(maxsize=4096)
+def _fmt_mtime(seconds: int) -> str:
+    """Local 'YYYY-MM-DD HH:MM:SS' for a whole-second mtime. Sessions saved in the same second share one entry."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
+
+
+def clean_session_id(session_id: str) -> str:
+    """
+    Returns 'session_id' if it is safe to use as a file name, raising ValueError otherwise.
+    Separators, parent references and hidden names are rejected instead of being
+    stripped, so '../other' can never resolve to some other session.
+    """
+    clean = os.path.basename(session_id)
+    if not clean or clean != session_id or clean.startswith('.'):
+        raise ValueError(f"invalid session_id: {session_id!r}")
+    return clean
+
+
+class StalePrecondition(Exception):
+    """Raised when a guarded save finds the session changed on disk since the caller read it."""
+
+
+def _seek_read(fd: int, offset: int, length: int) -> bytes:
+    """os.pread stand-in for platforms without it."""
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+
+class SessionWriter:
+    """
+    Background writer for session snapshots.
+    Saves are queued and a single daemon thread drains them in batches of up to
+    'max_batch', writing only the newest snapshot of each session in the batch
+    together with every message appended to it since the last write.
+    Writes happen at most once every 'min_interval' seconds; saves arriving in
+    between are folded into the next batch instead of each hitting the disk.
+    """
+
+    _STOP = object()
+
+    def __init__(self, write, max_batch: int = 32, min_interval: float = 0.0) -> None:
+        self._write = write
+        self.max_batch = max_batch
+        self.min_interval = min_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._flushing = threading.Event()
+        self._last_flush = 0.0
+
+    def enqueue(self, session_id: str, history, appended: list | None = None) -> None:
+        """
+        Queues a snapshot to be written and returns immediately.
+        'appended' holds the messages that are new since the previous snapshot;
+        None means the whole message journal has to be rewritten.
+        """
+        self._ensure_started()
+        self._queue.put((session_id, history, appended))
+
+    def flush(self) -> None:
+        """Writes everything queued right away, skipping the debounce wait, and blocks until done."""
+        self._flushing.set()
+        try:
+            self._queue.join()
+        finally:
+            self._flushing.clear()
+
+    def close(self) -> None:
+        """Flushes pending snapshots and stops the writer thread. A later save starts it again."""
+        self.flush()
+        with self._start_lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._queue.put(self._STOP)
+        thread.join()
+
+    def _ensure_started(self) -> None:
+        """Starts the writer thread on first use."""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        """
+        Collects whatever is queued (up to max_batch) and writes it as one batch,
+        waiting out the rest of 'min_interval' since the last write unless a flush is requested.
+        """
+        while True:
+            first = self._queue.get()
+            if first is self._STOP:
+                self._queue.task_done()
+                return
+            batch = [first]
+            stop = False
+            deadline = self._last_flush + self.min_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0 and not self._flushing.is_set():
+                        item = self._queue.get(timeout=min(remaining, 0.05))
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    if remaining > 0 and not self._flushing.is_set():
+                        continue
+                    break
+                if item is self._STOP:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            finally:
+                self._last_flush = time.monotonic()
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, batch: list[tuple]) -> None:
+        """Coalesces the batch to the latest snapshot per session and writes each one."""
+        latest = {}
+        for session_id, history, appended in batch:
+            if session_id in latest and appended is not None:
+                pending = latest[session_id][1]
+                appended = None if pending is None else pending + appended
+            latest[session_id] = (history, appended)
+        for session_id, (history, appended) in latest.items():
+            try:
+                self._write(session_id, history, appended)
+            except Exception:
+                logger.exception('Error saving session %s', session_id)
+
+
 class SessionManager:
     """
     Handles persistence of chat sessions using local JSON files.
     Provides methods to load, save, and manage session history independently 
     from the workflow engine.
+    Recently used sessions are kept in memory and disk writes are done by a
+    background thread, so the request path never waits on serialization.
+    Messages live in an append-only JSONL journal next to a small JSON snapshot
+    of the rest of the context, so a turn costs the same no matter how long
+    the conversation already is.
     """
 
-    def __init__(self, storage_dir: str = "memory") -> None:
-        """Initializes the manager with a specific directory for session files."""
+    parallel_stat_min = 32  # below this, thread start-up costs more than the overlapped stats save
+
+    def __init__(self, storage_dir: str = "memory", max_cached_sessions: int = 256, durable: bool = True, min_interval: float = 0.5, compact_every: int = 200, parallel_stat: bool = False) -> None:
+        """
+        Initializes the manager with a specific directory for session files.
+        With 'durable' set, every write is fsynced before it counts as saved, so a
+        crash cannot leave an empty or truncated session behind.
+        Disk writes are debounced to one batch per 'min_interval' seconds.
+        After 'compact_every' appended messages a session's journal is rewritten
+        from its current history, dropping whatever has been trimmed from it.
+        Set 'parallel_stat' when the directory is on network storage, where
+        list_sessions is bound by one round trip per stat call.
+        """
         self.storage_dir = storage_dir
+        self.max_cached_sessions = max_cached_sessions
+        self.durable = durable
+        self.compact_every = compact_every
+        self.parallel_stat = parallel_stat
+        self._journal_appends: dict[str, int] = {}
+        self._last_hash: dict[str, bytes] = {}
+        self._cache: OrderedDict[str, list] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Serializes every write: the background writer and guarded saves share the files.
+        self._write_lock = threading.RLock()
+        self._writer = SessionWriter(self._write_history, min_interval=min_interval)
+        self._list_cache: tuple[int, list[dict]] | None = None
     
     def _get_path(self, session_id: str) -> str:
-        """Constructs the full file path for a given session ID."""
-        return f"{self.storage_dir}/{session_id}.json"
+        """Constructs the full file path for a given session ID, rejecting anything that is not a plain name."""
+        return os.path.join(self.storage_dir, clean_session_id(session_id) + ".json")
+
+    def _journal_path(self, session_id: str) -> str:
+        """Path of the JSONL file holding the session's messages, one per line."""
+        return os.path.join(self.storage_dir, clean_session_id(session_id) + ".jsonl")
     
     def load_history(self, session_id: str) -> str:
         """
-        Loads the conversation history from a JSON file.
+        Loads the conversation history, from memory when the session is cached
+        or from its JSON file otherwise.
         If the file is corrupted, it renames it to .corrupted and returns an empty list.
         """
 
+        cached = self._cached(session_id)
+        if cached is not None:
+            return cached
+
+        history = self._read_history(session_id)
+        if history:
+            self._remember(session_id, history)
+        return self._copy(history)
+
+    async def load_history_async(self, session_id: str):
+        """
+        Same as load_history for async callers. Cached sessions return right away;
+        a cache miss reads and decodes the file in a worker thread, so the event
+        loop keeps streaming other responses meanwhile.
+        """
+        cached = self._cached(session_id)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self.load_history, session_id)
+
+    def _cached(self, session_id: str):
+        """Returns a copy of the cached session, or None when it is not in memory."""
+        with self._cache_lock:
+            if session_id in self._cache:
+                self._cache.move_to_end(session_id)
+                return self._copy(self._cache[session_id])
+        return None
+
+    def _read_history(self, session_id: str):
+        """Reads a session snapshot and its message journal from disk."""
         file_path = self._get_path(session_id)
-        if os.path.exists(file_path):
+        try:
+            data = _loads(_read_bytes(file_path))
+
+            # Older sessions keep their messages inside the snapshot itself.
+            if not isinstance(data, list):
+                messages = self._read_journal(session_id)
+                if data is None:
+                    data = messages or []
+                elif messages is not None:
+                    data['conversation_history'] = messages
+            logger.info('session loaded: %s (%d)', file_path, len(data))
+            return data
+
+        except FileNotFoundError:
+            logger.info('Session not found: %s', file_path)
+            return []
+        
+        except JSONDecodeError:
+            corrupted_path = f'{file_path}.corrupted'
+            logger.error('Corrupted JSON in %s. Renaming to %s', file_path, corrupted_path) 
+
             try:
-                 with open (file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logger.info(f'session loaded: {file_path} ({len(data)})')
-                    return data
-            
-            except json.JSONDecodeError:
-                corrupted_path = f'{file_path}.corrupted'
-                logger.error(f'Corrupted JSON in {file_path}. Renaming to {corrupted_path}') 
+                os.rename(file_path, corrupted_path)
+            except Exception as rename_error:
+                logger.error('Could not rename corrupted file: %s. Renaming to %s', rename_error, corrupted_path)
+            return []
+        
+        except Exception as e:
+            logger.error('Unexpected error: %s', e)
+            return []
+    
+    def load_recent(self, session_id: str, max_bytes: int = 256 * 1024) -> list:
+        """
+        Returns the latest messages of a session without parsing all of it.
+        Only the last 'max_bytes' of the journal are read; a line cut off at the
+        start of that window is dropped. Cached sessions are answered from memory, and
+        sessions without a journal fall back to a full load.
+        """
+        cached = self._cached(session_id)
+        if cached is not None:
+            return self._messages(cached)
 
-                try:
-                    os.rename(file_path, corrupted_path)
-                except Exception as rename_error:
-                    logger.error(f'Could not rename corrupted file: {rename_error}. Renaming to {corrupted_path}')
-                return []
-            
-            except Exception as e:
-                logger.error(f'Unexpected error: {e}')
-                return []
-            
-        else:
-             logger.info(f"Session not found: {file_path}")
-             return []
+        try:
+            fd = os.open(self._journal_path(session_id), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except FileNotFoundError:
+            return list(self._messages(self.load_history(session_id)))
+        try:
+            size = os.fstat(fd).st_size
+            # Start one byte early: the window's first line is complete exactly when that byte is a newline.
+            offset = max(0, size - max_bytes - 1)
+            raw = os.pread(fd, size - offset, offset) if hasattr(os, "pread") else _seek_read(fd, offset, size - offset)
+        finally:
+            os.close(fd)
+
+        if offset:
+            newline = raw.find(b"\n")
+            raw = raw[newline + 1:] if newline >= 0 else b""
+        return self._parse_journal(session_id, raw.splitlines())
+
+    def _read_journal(self, session_id: str) -> list | None:
+        """
+        Reads the message journal, or returns None when the session has none yet.
+        A torn last line from an interrupted append is skipped.
+        """
+        try:
+            raw = _read_bytes(self._journal_path(session_id))
+        except FileNotFoundError:
+            return None
+
+        return self._parse_journal(session_id, raw.splitlines())
+
+    @staticmethod
+    def _parse_journal(session_id: str, lines: list[bytes]) -> list:
+        """Decodes journal lines, skipping any that are unreadable."""
+        try:
+            # Parse every line in a single decoder call; fall back line by line only when one is broken.
+            return _loads(b"[" + b",".join(lines) + b"]")
+        except JSONDecodeError:
+            pass
+
+        messages = []
+        for line in lines:
+            try:
+                messages.append(_loads(line))
+            except JSONDecodeError:
+                logger.warning('Skipping unreadable line in journal of session %s', session_id)
+        return messages
     
-    def save_history(self, session_id: str, history: list) -> None:
+    def save_history(self, session_id: str, history: list, expected_prev_sha256: bytes | None = None) -> None:
+        """
+        Stores the provided history in memory and queues it to be written to disk.
+        Returns immediately; the background writer persists it.
+        With 'expected_prev_sha256' (taken from session_digest after loading) the save
+        is guarded instead: it is written right away, and raises StalePrecondition
+        without writing anything if another writer changed the session meanwhile.
+        """
+        clean_session_id(session_id)
+        snapshot = self._copy(history)
+        with self._cache_lock:
+            previous = self._cache.get(session_id)
+        appended = self._new_messages(previous, snapshot)
+        if expected_prev_sha256 is None:
+            self._remember(session_id, snapshot)
+            self._writer.enqueue(session_id, snapshot, appended)
+            return
+
+        self._writer.flush()
+        with self._write_lock:
+            if self._disk_digest(session_id) != expected_prev_sha256:
+                raise StalePrecondition(f"Session {session_id} changed since it was read")
+            self._write_history(session_id, snapshot, appended, verify=True)
+        self._remember(session_id, snapshot)
+
+    def session_digest(self, session_id: str) -> bytes:
+        """
+        SHA-256 of the session as stored on disk (snapshot, then journal), after
+        pending saves are written. Missing files count as empty.
+        """
+        self._writer.flush()
+        with self._write_lock:
+            return self._disk_digest(session_id)
+
+    def _disk_digest(self, session_id: str) -> bytes:
+        """SHA-256 of the session files as they are on disk right now."""
+        digest = hashlib.sha256()
+        for path in (self._get_path(session_id), self._journal_path(session_id)):
+            try:
+                data = _read_bytes(path)
+            except FileNotFoundError:
+                data = b""
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.digest()
+
+    def append_message(self, session_id: str, message: dict) -> None:
+        """
+        Adds one message to a session. Only that message is appended to the journal;
+        the rest of the session is left as it was. Like save_history, the write
+        happens in the background; call flush() to wait for it.
+        """
+        history = self.load_history(session_id)
+        if isinstance(history, dict):
+            # _messages hands back a detached list when the context has none yet.
+            if history.get('conversation_history') is None:
+                history['conversation_history'] = []
+            history['conversation_history'].append(message)
+        else:
+            history.append(message)
+        self.save_history(session_id, history)
+
+    def flush(self) -> None:
+        """Writes every pending save to disk now and waits for it."""
+        self._writer.flush()
+
+    def close(self) -> None:
+        """Flushes pending saves and stops the background writer, e.g. on shutdown."""
+        self._writer.close()
+
+    def _write_history(self, session_id: str, history, appended: list | None = None, verify: bool = False) -> None:
         """
-        Saves the provided history list to a JSON file.
-        Creates the storage directory if it does not exist.
+        Appends the new messages to the session journal and rewrites the small
+        snapshot of everything else. The journal is rewritten whole when
+        'appended' is None, the session has no journal yet, this manager has not
+        written it before, or it is due for compaction.
+        With 'verify', every write is read back and compared before it is kept.
+        Runs under the manager's write lock, so saves of a session never interleave.
+        If a write fails, the next save of the session rewrites everything.
+        A save whose messages and snapshot both match the last write is skipped.
         """
 
         file_path = self._get_path(session_id)
-        temp_path = file_path + ".tmp"
-        os.makedirs(self.storage_dir, exist_ok=True)
-        with open (temp_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=4, ensure_ascii=False)
-        os.replace(temp_path, file_path)
-        logger.info(f"session saved: {file_path} ({len(history)} messages)")
+        journal_path = self._journal_path(session_id)
+
+        # Plain history lists have nothing besides messages; 'null' marks that.
+        meta = None
+        if isinstance(history, dict):
+            meta = {key: value for key, value in history.items() if key != 'conversation_history'}
+        snapshot = _dumps_snapshot(meta)
+        snapshot_hash = hashlib.sha256(snapshot).digest()
+        with self._write_lock:
+            # An empty 'appended' means the messages equal the ones last saved, and a
+            # known append count means this manager wrote the journal they are in.
+            unchanged = appended == [] and session_id in self._journal_appends
+            if unchanged and self._last_hash.get(session_id) == snapshot_hash:
+                return
+
+            messages = self._messages(history)
+            try:
+                appends = self._journal_appends.get(session_id, 0) + len(appended or ())
+                if (appended is None or session_id not in self._journal_appends or appends >= self.compact_every
+                        or not self._append(journal_path, b"".join(_dumps(m) for m in appended), verify)):
+                    self._replace(journal_path, b"".join(_dumps(m) for m in messages), verify)
+                    appends = 0
+                self._journal_appends[session_id] = appends
+
+                self._replace(file_path, snapshot, verify)
+                self._last_hash[session_id] = snapshot_hash
+            except BaseException:
+                # The files may hold part of this save and the cache has moved on,
+                # so the next save cannot be expressed as an append.
+                self._journal_appends.pop(session_id, None)
+                self._last_hash.pop(session_id, None)
+                raise
+            self._sync_dir()
+            # Renames within the same mtime tick would not change the directory's mtime.
+            self._list_cache = None
+            logger.info('session saved: %s (%d messages)', file_path, len(messages))
+
+    def _append(self, path: str, payload: bytes, verify: bool = False) -> bool:
+        """
+        Appends to an existing file. Returns False when the file does not exist,
+        found out by opening it rather than with a separate stat call.
+        """
+        try:
+            with open(path, 'r+b') as f:
+                start = f.seek(0, os.SEEK_END)
+                f.write(payload)
+                self._sync(f)
+                if verify:
+                    f.flush()
+                    f.seek(start)
+                    if f.read(len(payload)) != payload:
+                        f.truncate(start)
+                        raise OSError(f"Appended data in {path} did not read back intact")
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _replace(self, path: str, payload: bytes, verify: bool = False) -> None:
+        """
+        Writes 'payload' to a temporary file and atomically swaps it into place.
+        The temporary file gets a unique name in the same directory, so the rename
+        never crosses filesystems and a crashed write cannot collide with the next one;
+        it is removed if anything fails before the rename.
+        The directory is only created when creating the temporary file finds it
+        missing, so steady-state saves pay no existence check.
+        The data is synced before the rename, so the new name never points at unwritten blocks.
+        With 'verify', the temporary file is read back first and must match the payload.
+        """
+        directory, name = os.path.split(path)
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        except FileNotFoundError:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        try:
+            try:
+                # One unbuffered write of the already-serialized payload; the loop only
+                # matters for the rare short write.
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+                if self.durable:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            if verify and _read_bytes(temp_path) != payload:
+                raise OSError(f"Temporary file for {path} did not read back intact")
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _sync(self, f) -> None:
+        """Flushes a file's data to disk when durable writes are on."""
+        if self.durable:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync_dir(self) -> None:
+        """
+        Syncs the storage directory so completed renames survive a crash.
+        Skipped where directories cannot be opened, such as on Windows.
+        """
+        if not self.durable:
+            return
+        try:
+            dir_fd = os.open(self.storage_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    @staticmethod
+    def _messages(history) -> list:
+        """The message list of a session, whether it is stored as a context dict or a plain list."""
+        if isinstance(history, dict):
+            return history.get('conversation_history', [])
+        return history
+
+    @classmethod
+    def _new_messages(cls, previous, current) -> list | None:
+        """
+        Messages added to the end of 'current' since the previously cached snapshot.
+        Returns None, meaning the journal has to be rewritten, when there is nothing
+        to compare against or the earlier messages were removed, reordered or edited.
+        """
+        if previous is None:
+            return None
+        known = cls._messages(previous)
+        messages = cls._messages(current)
+        if len(messages) < len(known) or messages[:len(known)] != known:
+            return None
+        return messages[len(known):]
+
+    def _remember(self, session_id: str, history) -> None:
+        """Caches a session, evicting the least recently used ones past the limit."""
+        with self._cache_lock:
+            self._cache[session_id] = history
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_cached_sessions:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _copy(history):
+        """
+        Copies the containers and each message dict so callers can mutate what they
+        get without touching the cache, and edits still show up as changes on save.
+        """
+        if isinstance(history, dict):
+            copied = {key: list(value) if isinstance(value, list) else value for key, value in history.items()}
+            if isinstance(copied.get('conversation_history'), (list, deque)):
+                copied['conversation_history'] = [dict(m) if isinstance(m, dict) else m for m in copied['conversation_history']]
+            return copied
+        return [dict(m) if isinstance(m, dict) else m for m in history]
     
     
     def list_sessions(self) -> list[dict]:
@@ -73,44 +622,85 @@ class SessionManager:
         Lists all available sessions in the storage directory.
         Returns a list of dictionaries containing session metadata:
         [{'id': 'session_1', 'updated_at': '2024-03-20 15:30:00'}, ...]
+        The listing is reused while the directory's mtime is unchanged.
         """
        
-       if not os.path.exists(self.storage_dir):
+       try:
+           dir_mtime = os.stat(self.storage_dir).st_mtime_ns
+       except FileNotFoundError:
            return []
-       
-       sessions = []
-
-       for filename in os.listdir(self.storage_dir):
-           if filename.endswith(".json"):
-               full_path = os.path.join(self.storage_dir, filename)
-               mtime = os.path.getmtime(full_path)
-               date_str = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
-               session_id = os.path.splitext(filename)[0]
-               session_data = {
-                   "id": session_id,
-                   "updated_at": date_str,
-               }
-               sessions.append(session_data)
-
-       return sessions
+
+       cached = self._list_cache
+       if cached is not None and cached[0] == dir_mtime:
+           return list(cached[1])
+
+       try:
+           entries = os.scandir(self.storage_dir)
+       except FileNotFoundError:
+           return []
+
+       # DirEntry carries the file type from readdir, so only matching files cost a stat.
+       # Hidden names (temp files, '.json' itself) can never be valid session IDs.
+       files = []
+       with entries:
+           for entry in entries:
+               name = entry.name
+               if name[0] != "." and name.endswith(".json") and entry.is_file(follow_symlinks=False):
+                   files.append(entry)
+
+       if self.parallel_stat and len(files) > self.parallel_stat_min:
+           with ThreadPoolExecutor(max_workers=16, thread_name_prefix="session-stat") as pool:
+               stats = list(pool.map(os.DirEntry.stat, files))
+       else:
+           stats = [entry.stat() for entry in files]
+
+       sessions = [
+           {"id": entry.name[:-5], "updated_at": _fmt_mtime(int(st.st_mtime))}
+           for entry, st in zip(files, stats)
+       ]
+
+       self._list_cache = (dir_mtime, sessions)
+       return list(sessions)
     
 
     def delete_session(self, session_id: str) -> bool:
         """
         Safely deletes a session file by its ID.
         Returns True if deleted, False if the session was not found.
+        Raises ValueError for IDs that are not plain names.
         """
-        clean_id = os.path.basename(session_id)
-        file_path = self._get_path(clean_id)
+        file_path = self._get_path(session_id)
+        self._writer.flush()
+        with self._cache_lock:
+            self._cache.pop(session_id, None)
 
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f'Session deleted: {session_id}')
+        # Under the write lock, so a write finishing meanwhile cannot leave its hash behind.
+        with self._write_lock:
+            self._journal_appends.pop(session_id, None)
+            self._last_hash.pop(session_id, None)
+
+            try:
+                os.unlink(file_path)
+                try:
+                    os.unlink(self._journal_path(session_id))
+                except FileNotFoundError:
+                    pass
+                logger.info('Session deleted: %s', session_id)
                 return True
+
+            except FileNotFoundError:
+                return False
         
-        except Exception as e:
-            logger.exception(f'Error during deleting session')
-            return False
-        
-        return False
+            except OSError:
+                logger.exception('Error during deleting session')
+                return False
+
+            finally:
+                # Dropped after the unlink, so a listing taken in between cannot be kept
+                # when the directory mtime is too coarse to show the removal.
+                self._list_cache = None
+
+
+SESSIONS = SessionManager()
+# The writer is a daemon thread; make sure queued saves reach disk when the process exits normally.
+atexit.register(SESSIONS.close)
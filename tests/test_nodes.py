@@ -1,14 +1,26 @@
+import asyncio
+import json
 import os
 import sys
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 import pytest
-from nodes import UppercaseNode, ReverseNode, TrimNode, ReplaceNode, FileReadNode, RouterNode, LLMNode
-from engine import WorkflowEngine
+import httpx
+from nodes import close_shared_clients, BaseNode, NODE_REGISTRY, AnomalyDetectorNode, create_node_from_dict, UppercaseNode, ReverseNode, TrimNode, ReplaceNode, FileReadNode, MemoryNode, RouterNode, LLMNode, WebSearchNode
+from engine import WorkflowEngine, WorkflowContext
+from session_manager import SessionManager
+
+
+async def collect_async(stream):
+    return "".join([chunk async for chunk in stream])
+
+
+def collect(stream):
+    return asyncio.run(collect_async(stream))
 
 
 @pytest.fixture
@@ -16,7 +28,7 @@ def mock_engine():
 
     class MockEngine:
         def __init__(self):
-            self.context = {}
+            self.context = WorkflowContext()
     return MockEngine()
 
 @pytest.fixture
@@ -30,10 +42,127 @@ def test_workflow_engine(workflow_engine):
     workflow_engine.add_node(ReverseNode("Reverse Node"))
 
     input_data = "   Hello World   "
-    result = workflow_engine.run(input_data)
+    result = collect(workflow_engine.run(input_data))
 
     assert result == "DLROW OLLEH"
 
+def test_workflow_engine_parallel_layers(workflow_engine):
+    workflow_engine.add_node(TrimNode("Trim Node"))
+    workflow_engine.add_node(UppercaseNode("Uppercase Node"))
+    workflow_engine.add_node(ReverseNode("Reverse Node"))
+    workflow_engine.connections = [
+        {'from': 'trim_node', 'to': 'uppercase_node'},
+        {'from': 'trim_node', 'to': 'reverse_node'},
+    ]
+
+    layers = workflow_engine._build_layers(workflow_engine._predecessor_map())
+    result = collect(workflow_engine.run("  abc  "))
+
+    assert layers == [[0], [1, 2]]
+    assert result == "ABCcba"
+
+def test_load_from_json_rejects_cycle(tmp_path):
+    workflow_path = tmp_path / "cycle.json"
+    workflow_path.write_text(json.dumps({
+        "nodes": [{"id": "trim", "type": "TrimNode"}, {"id": "upper", "type": "UppercaseNode"}],
+        "connections": [{"from": "trim", "to": "upper"}, {"from": "upper", "to": "trim"}],
+    }), encoding="utf-8")
+
+    with pytest.raises(ValueError, match="cycle"):
+        WorkflowEngine.load_from_json(str(workflow_path))
+
+def test_load_from_json_requires_secrets(tmp_path, monkeypatch):
+    monkeypatch.delenv("ROUTELLM_API_KEY", raising=False)
+    workflow_path = tmp_path / "llm.json"
+    workflow_path.write_text(json.dumps({
+        "nodes": [{"id": "llm", "type": "LLMNode", "params": {"model": "gpt-4o-mini", "system_prompt": "Hi"}}],
+        "connections": [],
+    }), encoding="utf-8")
+
+    with pytest.raises(ValueError, match="ROUTELLM_API_KEY"):
+        WorkflowEngine.load_from_json(str(workflow_path))
+
+def test_load_from_json_reuses_compiled_nodes(tmp_path):
+    workflow_path = tmp_path / "chain.json"
+    workflow_path.write_text(json.dumps({
+        "nodes": [{"id": "trim", "type": "TrimNode"}, {"id": "upper", "type": "UppercaseNode"}],
+        "connections": [{"from": "trim", "to": "upper"}],
+    }), encoding="utf-8")
+
+    first = WorkflowEngine.load_from_json(str(workflow_path))
+    second = WorkflowEngine.load_from_json(str(workflow_path))
+
+    assert first.nodes[0] is second.nodes[0]
+    assert first.context is not second.context
+
+def test_persisting_trained_weights_keeps_the_compiled_workflow(tmp_path):
+    workflow_path = tmp_path / "costs.json"
+    workflow_path.write_text(json.dumps({
+        "nodes": [{"id": "cost_predictor", "type": "CostPredictNode", "params": {"w": [0.0, 0.0], "b": 0.0}}],
+        "connections": [],
+    }), encoding="utf-8")
+    os.utime(workflow_path, ns=(0, 0))
+    engine = WorkflowEngine.load_from_json(str(workflow_path))
+    engine.nodes[0].train("hola que tal", 0.5)
+
+    engine._write_workflow_state(str(workflow_path))
+
+    assert WorkflowEngine.load_from_json(str(workflow_path)).nodes[0] is engine.nodes[0]
+    assert json.loads(workflow_path.read_text())["nodes"][0]["params"]["b"] != 0.0
+    assert workflow_path.read_text().startswith('{\n    "nodes"')
+    assert [p.name for p in tmp_path.iterdir()] == ["costs.json"]
+
+def test_closing_a_run_finalizes_the_streaming_node():
+    finalized = []
+
+    class StreamingNode(BaseNode):
+        __slots__ = ()
+
+        async def execute(self, input_data, engine):
+            try:
+                for chunk in ("a", "b", "c"):
+                    yield chunk
+            finally:
+                finalized.append(input_data)
+
+    async def _interrupt():
+        engine = WorkflowEngine()
+        engine.add_node(StreamingNode("Stream"), "stream")
+        run = engine.run("hola")
+        assert await run.__anext__() == "a"
+        await run.aclose()
+        return list(finalized)
+
+    assert asyncio.run(_interrupt()) == ["hola"]
+
+def test_save_to_json_exports_trained_weights(tmp_path):
+    engine = WorkflowEngine()
+    engine.add_node(create_node_from_dict({"id": "cost_predictor", "type": "CostPredictNode", "params": {"w": [0.0, 0.0], "b": 0.0}}))
+    engine.save_to_json(str(tmp_path / "before.json"))
+
+    engine.nodes[0].train("hola que tal", 0.5)
+    engine.save_to_json(str(tmp_path / "after.json"))
+
+    after = json.loads((tmp_path / "after.json").read_text())["nodes"][0]["params"]
+    assert after == engine.nodes[0].to_dict()["params"]
+    assert after["b"] != 0.0
+
+def test_restore_session_brings_back_only_recent_history(tmp_path):
+    sessions = SessionManager(storage_dir=str(tmp_path))
+    history = [{"role": "user", "content": str(i)} for i in range(30)]
+    sessions.save_history("session", {"conversation_history": history, "file_content": "old file", "user_input": "old", "extras": {"lang": "es"}})
+    engine = WorkflowEngine(session_manager=sessions)
+
+    asyncio.run(engine._restore_session("session"))
+
+    assert engine.context.conversation_history == history[-engine.max_restored_messages:]
+    assert engine.context.file_content is None and engine.context.user_input == ""
+    assert engine.context.extras == {"lang": "es"}
+
+def test_context_snapshot_keeps_declaration_order():
+    assert list(WorkflowContext().to_dict())[:3] == ["user_input", "file_content", "web_search"]
+    assert list(WorkflowContext().to_dict())[-2:] == ["conversation_history", "extras"]
+
 def test_trim_node(mock_engine):
     trim_node = TrimNode("Trim Node")
     input_data = "   Hello World   "
@@ -59,33 +188,65 @@ def test_replace_node():
     result = replace_node.execute(input_data, mock_engine)
     assert result == "Hello Boss"
 
+@pytest.mark.parametrize("node_class", [*NODE_REGISTRY.values(), AnomalyDetectorNode])
+def test_nodes_have_no_instance_dict(node_class):
+    assert all('__slots__' in vars(klass) for klass in node_class.__mro__[:-1])
+
+def test_create_node_from_dict_ignores_unknown_params():
+    node = create_node_from_dict({'id': 'replace_step', 'type': 'ReplaceNode', 'params': {'old': 'a', 'new': 'b', 'unused': 1}})
+
+    assert node.name == "Replace Step"
+    assert node.execute("banana", None) == "bbnbnb"
+
 def test_file_read_node_success(mock_engine, tmp_path):
     file_path = tmp_path / "my_info.txt"
     file_path.write_text("Carlos is a software developer.", encoding="utf-8")
     file_node = FileReadNode("File Node", str(file_path))
     result = file_node.execute("", mock_engine)
-    assert "Carlos" in mock_engine.context.get('file_content', '')
+    assert "Carlos" in mock_engine.context.file_content
     assert result == ""
 
 def test_file_read_node_error(mock_engine):
     file_node = FileReadNode("File Node", "non_existent_file.txt")
     result = file_node.execute("", mock_engine)
     assert result == "File not found: non_existent_file.txt."
-    assert 'file_content' not in mock_engine.context
+    assert mock_engine.context.file_content is None
 
 def test_file_read_node_empty(mock_engine, tmp_path):
     file_path = tmp_path / "empty.txt"
     file_path.write_text("", encoding="utf-8")
     file_node = FileReadNode("Empty File Node", str(file_path))
     result = file_node.execute("", mock_engine)
-    assert mock_engine.context.get('file_content', '') == ""
+    assert mock_engine.context.file_content == ""
     assert result == ""
 
+def test_file_read_node_picks_up_changes(mock_engine, tmp_path):
+    file_path = tmp_path / "my_info.txt"
+    file_path.write_text("Carlos", encoding="utf-8")
+    file_node = FileReadNode("File Node", str(file_path))
+    file_node.execute("", mock_engine)
+
+    file_path.write_text("Carlos Ramirez", encoding="utf-8")
+    file_node.execute("", mock_engine)
+
+    assert mock_engine.context.file_content == "Carlos Ramirez"
+
+def test_memory_node_bounds_history(mock_engine):
+    memory = MemoryNode("memory", max_turns=2)
+    mock_engine.context.conversation_history = [{"role": "user", "content": str(i)} for i in range(6)]
+
+    result = memory.execute("Input", mock_engine)
+    mock_engine.context.conversation_history.append({"role": "assistant", "content": "6"})
+
+    assert result == "Input"
+    assert [m["content"] for m in mock_engine.context.conversation_history] == ["3", "4", "5", "6"]
+    assert mock_engine.context.to_dict()["conversation_history"][0] == {"role": "user", "content": "3"}
+
 def test_router_node_greeting(mock_engine):
     router = RouterNode("Router")
     result = router.execute("Hello", mock_engine)
 
-    assert mock_engine.context.get('needs_ai') is False
+    assert mock_engine.context.needs_ai is False
     assert "carlos" in result.lower()
 
 def test_router_node_query(mock_engine):
@@ -93,28 +254,64 @@ def test_router_node_query(mock_engine):
     query = "Can you provide a brief summary of Carlos's professional background?"
     result = router.execute(query, mock_engine)
 
-    assert mock_engine.context.get('needs_ai') is True
+    assert mock_engine.context.needs_ai is True
+    assert result == query
+
+def test_router_node_multi_word_greeting(mock_engine):
+    router = RouterNode("Router")
+    router.execute("So, who are you?", mock_engine)
+    assert mock_engine.context.needs_ai is False
+
+    router.execute("Who are your references?", mock_engine)
+    assert mock_engine.context.needs_ai is True
+
+def test_router_node_normalizes_spanish_greeting(mock_engine):
+    router = RouterNode("Router")
+    router.execute("¿Quién eres?", mock_engine)
+
+    assert mock_engine.context.needs_ai is False
+
+def test_router_node_ignores_greeting_inside_words(mock_engine):
+    router = RouterNode("Router")
+    query = "What is his philosophy on testing?"
+    result = router.execute(query, mock_engine)
+
+    assert mock_engine.context.needs_ai is True
     assert result == query
 
 
+def mock_stream(*contents, usage=None):
+    async def _stream():
+        for content in contents:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = content
+            chunk.usage = None
+            yield chunk
+        if usage is not None:
+            yield MagicMock(choices=[], usage=usage)
+    return _stream()
+
+
 def test_llm_node_with_mock(mock_engine, monkeypatch):
     monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
     node = LLMNode("AI Node", "gpt-4o", "You are a helpful assistant.")
-    mock_response = MagicMock()
-    mock_response.choices[0].message.content = "Mocked AI response."
+    usage = MagicMock(prompt_tokens=1000, completion_tokens=100)
+    mock_response = mock_stream("Mocked ", "AI response.", usage=usage)
 
-    with patch.object(node.client.chat.completions, 'create', return_value=mock_response) as mock_create:
-        result = node.execute("¿Quien es Carlos?", mock_engine)
+    with patch.object(node.client.chat.completions, 'create', new=AsyncMock(return_value=mock_response)) as mock_create:
+        result = collect(node.execute("¿Quien es Carlos?", mock_engine))
         mock_create.assert_called_once()
 
     assert result == "Mocked AI response."
+    assert mock_engine.context.total_tokens_used == 1100
+    assert mock_engine.context.total_cost == pytest.approx(0.00021)
 
 def test_llm_node_skip_ai(mock_engine, monkeypatch):
     monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
     node = LLMNode("AI Node", "gpt-4o", "System prompt.")
-    mock_engine.context['needs_ai'] = False
+    mock_engine.context.needs_ai = False
 
-    result = node.execute("Input", mock_engine)
+    result = collect(node.execute("Input", mock_engine))
 
     assert result == "Input"
 
@@ -122,14 +319,134 @@ def test_llm_node_handle_api_error(mock_engine, monkeypatch):
     monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
     node = LLMNode("AI Node", "gpt-4o", "System prompt.")
     
-    with patch.object(node.client.chat.completions, 'create', side_effect=Exception("API error")):
-        result = node.execute("Test query", mock_engine)
+    with patch.object(node.client.chat.completions, 'create', new=AsyncMock(side_effect=Exception("API error"))):
+        result = collect(node.execute("Test query", mock_engine))
+
+    assert result == "[error] API error"
+    assert mock_engine.context.conversation_history == []
+
+
+def test_web_search_node_with_mock(mock_engine, monkeypatch):
+    monkeypatch.setenv("TAVILY_API_KEY", "test_api_key")
+    node = WebSearchNode("Web Search", max_results=1)
+    request = httpx.Request("POST", node.base_url)
+    mock_response = httpx.Response(200, json={"results": [{"title": "Carlos", "url": "https://example.com", "snippet": "Dev"}]}, request=request)
+
+    with patch.object(httpx.AsyncClient, 'post', new=AsyncMock(return_value=mock_response)):
+        result = asyncio.run(node.aexecute("Carlos", mock_engine))
 
-    assert "API error" in result
+    assert result == "Carlos"
+    assert "Title: Carlos" in mock_engine.context.web_search
 
-        
+def test_web_search_node_handle_http_error(mock_engine, monkeypatch):
+    monkeypatch.setenv("TAVILY_API_KEY", "test_api_key")
+    node = WebSearchNode("Web Search")
 
+    with patch.object(httpx.AsyncClient, 'post', new=AsyncMock(side_effect=httpx.ConnectError("offline"))):
+        result = asyncio.run(node.aexecute("Carlos", mock_engine))
 
+    assert result == "Carlos"
+    assert mock_engine.context.web_search.startswith("Error during web search")
 
+def test_llm_node_caches_answers(mock_engine, monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("AI Node", "gpt-4o", "System prompt.", temperature=0.2)
+    LLMNode._responses.clear()
+
+    with patch.object(node.client.chat.completions, 'create', new=AsyncMock(return_value=mock_stream("Cached answer.", usage=MagicMock(prompt_tokens=10, completion_tokens=2)))) as mock_create:
+        first = collect(node.execute("What does Carlos do?", mock_engine))
+        mock_engine.context.conversation_history = []
+        second = collect(node.execute("What does Carlos do?", mock_engine))
+
+    mock_create.assert_called_once()
+    assert first == second == "Cached answer."
+    assert len(mock_engine.context.conversation_history) == 2
+
+def test_identical_request_survives_an_abandoned_leader(mock_engine, monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("AI Node", "gpt-4o", "System prompt.", temperature=0)
+    streams = [mock_stream("Partial ", "answer."), mock_stream("Full answer.", usage=MagicMock(prompt_tokens=10, completion_tokens=2))]
+
+    async def _run():
+        leader = node.execute("Who abandons first?", mock_engine)
+        assert await leader.__anext__() == "Partial "
+        waiter = asyncio.create_task(collect_async(node.execute("Who abandons first?", mock_engine)))
+        await asyncio.sleep(0)
+        await leader.aclose()
+        return await waiter
+
+    with patch.object(node.client.chat.completions, 'create', new=AsyncMock(side_effect=streams)) as mock_create, \
+         patch.object(LLMNode, '_finalize'):
+        assert asyncio.run(_run()) == "Full answer."
+    assert mock_create.await_count == 2
+
+def test_llm_node_reuses_system_message(mock_engine, monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("AI Node", "gpt-4o", "System prompt.")
+    mock_engine.context.file_content = "Carlos is a developer."
 
+    first = node._build_messages("one", mock_engine)[0]["content"]
+    second = node._build_messages("two", mock_engine)[0]["content"]
+
+    assert first is second
+    assert "Carlos is a developer." in first
+
+def test_llm_node_execute_batch(mock_engine, monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("AI Node", "gpt-4o", "System prompt.")
+    output = MagicMock(content=b"\n".join([
+        json.dumps({"custom_id": "1", "response": {"body": {"choices": [{"message": {"content": "Second"}}], "usage": {"prompt_tokens": 10, "completion_tokens": 2}}}}).encode(),
+        json.dumps({"custom_id": "0", "response": {"body": {"choices": [{"message": {"content": "First"}}], "usage": {"prompt_tokens": 10, "completion_tokens": 2}}}}).encode(),
+    ]))
+
+    with patch.object(node.client.files, 'create', new=AsyncMock(return_value=MagicMock(id="file-in"))), \
+         patch.object(node.client.batches, 'create', new=AsyncMock(return_value=MagicMock(id="batch", status="completed", output_file_id="file-out", error_file_id=None))) as mock_batch, \
+         patch.object(node.client.files, 'content', new=AsyncMock(return_value=output)):
+        answers = asyncio.run(node.execute_batch(["one", "two"], mock_engine))
+
+    mock_batch.assert_called_once()
+    assert answers == ["First", "Second"]
+    assert mock_engine.context.total_tokens_used == 24
+    assert mock_engine.context.conversation_history == []
+
+def test_llm_node_execute_batch_reports_errors_and_gives_up(mock_engine, monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("AI Node", "gpt-4o", "System prompt.")
+    errors = MagicMock(content=json.dumps({"custom_id": "1", "response": {"body": {"error": {"message": "bad request"}}}}).encode())
+
+    with patch.object(node.client.files, 'create', new=AsyncMock(return_value=MagicMock(id="file-in"))), \
+         patch.object(node.client.batches, 'create', new=AsyncMock(return_value=MagicMock(id="batch", status="failed", output_file_id=None, error_file_id="file-err"))), \
+         patch.object(node.client.files, 'content', new=AsyncMock(return_value=errors)):
+        answers = asyncio.run(node.execute_batch(["one", "two"], mock_engine))
+    assert answers[0] == "[error] No result returned by the batch."
+    assert "bad request" in answers[1]
+
+    with patch.object(node.client.files, 'create', new=AsyncMock(return_value=MagicMock(id="file-in"))), \
+         patch.object(node.client.batches, 'create', new=AsyncMock(return_value=MagicMock(id="batch", status="in_progress"))), \
+         patch.object(node.client.batches, 'cancel', new=AsyncMock()) as mock_cancel:
+        answers = asyncio.run(node.execute_batch(["one", "two"], mock_engine, max_wait=0))
+    mock_cancel.assert_awaited_once_with("batch")
+    assert answers[0].startswith("[error] Batch did not finish")
+
+def test_llm_node_execute_batch_with_no_inputs(mock_engine, monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("AI Node", "gpt-4o", "System prompt.")
+
+    with patch.object(node.client.files, 'create', new=AsyncMock()) as mock_upload:
+        assert asyncio.run(node.execute_batch([], mock_engine)) == []
+    mock_upload.assert_not_called()
+
+def test_llm_nodes_share_client(monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    first = LLMNode("First", "gpt-4o", "System prompt.")
+    second = LLMNode("Second", "gpt-4o-mini", "Other prompt.")
+
+    assert first.client is second.client
+
+def test_llm_node_gets_a_new_client_after_shutdown(monkeypatch):
+    monkeypatch.setenv("ROUTELLM_API_KEY", "test_api_key")
+    node = LLMNode("First", "gpt-4o", "System prompt.")
+    before = node.client
 
+    asyncio.run(close_shared_clients())
+    assert node.client is not before
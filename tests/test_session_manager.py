@@ -0,0 +1,378 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import pytest
+from session_manager import SessionManager, SessionWriter, StalePrecondition
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return SessionManager(storage_dir=str(tmp_path))
+
+
+def test_save_and_load_from_cache(manager):
+    history = [{"role": "user", "content": "hola"}]
+    manager.save_history("session", history)
+
+    loaded = manager.load_history("session")
+    loaded.append({"role": "assistant", "content": "hi"})
+
+    assert manager.load_history("session") == history
+
+def test_save_writes_file_in_background(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+
+    assert (tmp_path / "session.json").exists()
+
+def test_load_missing_session(manager):
+    assert manager.load_history("missing") == []
+
+def test_writer_keeps_latest_snapshot_per_session():
+    written = []
+    writer = SessionWriter(lambda session_id, history, appended: written.append((session_id, history, appended)))
+
+    writer._write_batch([("a", [1], [1]), ("b", [2], None), ("a", [1, 3], [3])])
+
+    assert written == [("a", [1, 3], [1, 3]), ("b", [2], None)]
+
+def test_save_appends_only_new_messages(manager, tmp_path):
+    first = {"role": "user", "content": "hola"}
+    context = {"user_input": "hola", "conversation_history": [first]}
+    manager.save_history("session", context)
+    manager.flush()
+
+    cached = manager.load_history("session")
+    cached["conversation_history"].append({"role": "assistant", "content": "hi"})
+    manager.save_history("session", cached)
+    manager.flush()
+
+    journal = (tmp_path / "session.jsonl").read_bytes().splitlines()
+    reloaded = SessionManager(storage_dir=str(tmp_path)).load_history("session")
+    assert len(journal) == 2
+    assert reloaded == {"user_input": "hola", "conversation_history": [first, {"role": "assistant", "content": "hi"}]}
+
+@pytest.mark.parametrize("keep", [0, 1])
+def test_save_rewrites_shrunk_history(manager, tmp_path, keep):
+    manager.save_history("session", [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}])
+    manager.flush()
+
+    history = manager.load_history("session")[:keep]
+    manager.save_history("session", history)
+    manager.flush()
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == history
+
+def test_save_writes_in_place_edits(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "a"}])
+    manager.flush()
+
+    history = manager.load_history("session")
+    history[0]["content"] = "edited"
+    assert manager.load_history("session") == [{"role": "user", "content": "a"}]
+
+    manager.save_history("session", history)
+    manager.flush()
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == [{"role": "user", "content": "edited"}]
+
+def test_failed_write_is_recovered_by_the_next_save(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "a"}])
+    manager.flush()
+
+    history = manager.load_history("session") + [{"role": "assistant", "content": "b"}]
+    with patch.object(manager, "_append", side_effect=OSError("disk full")):
+        manager.save_history("session", history)
+        manager.flush()
+    manager.save_history("session", history + [{"role": "user", "content": "c"}])
+    manager.flush()
+
+    reloaded = SessionManager(storage_dir=str(tmp_path)).load_history("session")
+    assert [m["content"] for m in reloaded] == ["a", "b", "c"]
+
+def test_delete_session(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+
+    assert manager.delete_session("session") is True
+    assert manager.delete_session("session") is False
+    assert manager.load_history("session") == []
+
+def test_load_history_async_reads_from_disk(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+
+    fresh = SessionManager(storage_dir=str(tmp_path))
+
+    assert asyncio.run(fresh.load_history_async("session")) == [{"role": "user", "content": "hola"}]
+
+def test_list_sessions_skips_journals_hidden_files_and_missing_dir(manager, tmp_path):
+    manager.save_history("session", {"conversation_history": [{"role": "user", "content": "hola"}]})
+    manager.flush()
+    (tmp_path / ".json").write_text("null\n")
+    (tmp_path / ".hidden.json").write_text("null\n")
+
+    assert [s["id"] for s in manager.list_sessions()] == ["session"]
+    assert SessionManager(storage_dir=str(tmp_path / "missing")).list_sessions() == []
+
+def test_durable_writes_fsync_files_and_directory(tmp_path):
+    durable = SessionManager(storage_dir=str(tmp_path))
+    relaxed = SessionManager(storage_dir=str(tmp_path), durable=False)
+
+    with patch("session_manager.os.fsync") as fsync:
+        durable._write_history("session", [{"role": "user", "content": "hola"}])
+        assert fsync.call_count == 3
+
+        fsync.reset_mock()
+        relaxed._write_history("session", [{"role": "user", "content": "hola"}])
+        fsync.assert_not_called()
+
+def test_writer_debounces_and_flushes_on_demand():
+    written = []
+    writer = SessionWriter(lambda session_id, history, appended: written.append(history), min_interval=60)
+    writer._last_flush = time.monotonic()
+
+    writer.enqueue("a", [1], [1])
+    writer.enqueue("a", [1, 2], [2])
+    writer.flush()
+    writer.close()
+
+    assert written == [[1, 2]]
+
+def test_snapshot_accepts_non_string_keys(manager, tmp_path):
+    manager.save_history("session", {"extras": {1: "one"}, "conversation_history": []})
+    manager.flush()
+
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == {"extras": {"1": "one"}, "conversation_history": []}
+
+def test_list_sessions_is_cached_until_a_write(manager):
+    manager.save_history("first", [{"role": "user", "content": "hola"}])
+    manager.flush()
+    listed = manager.list_sessions()
+
+    with patch("session_manager.os.scandir") as scandir:
+        assert manager.list_sessions() == listed
+        scandir.assert_not_called()
+
+    manager.save_history("second", [{"role": "user", "content": "hola"}])
+    manager.flush()
+    assert sorted(s["id"] for s in manager.list_sessions()) == ["first", "second"]
+
+def test_load_skips_torn_journal_line(manager, tmp_path):
+    manager.save_history("session", {"conversation_history": [{"role": "user", "content": "hola"}]})
+    manager.flush()
+    with open(tmp_path / "session.jsonl", "ab") as journal:
+        journal.write(b'{"role": "assis')
+
+    reloaded = SessionManager(storage_dir=str(tmp_path)).load_history("session")
+
+    assert reloaded["conversation_history"] == [{"role": "user", "content": "hola"}]
+
+def test_load_history_does_not_pre_check_existence(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+    fresh = SessionManager(storage_dir=str(tmp_path))
+
+    with patch("session_manager.os.path.exists", side_effect=AssertionError("exists() pre-check")), \
+         patch("session_manager.os.stat", side_effect=AssertionError("stat() pre-check")):
+        assert fresh.load_history("session") == [{"role": "user", "content": "hola"}]
+        assert fresh.load_history("missing") == []
+
+def test_append_message_and_compaction(tmp_path):
+    manager = SessionManager(storage_dir=str(tmp_path), compact_every=2)
+    manager.append_message("session", {"role": "user", "content": "1"})
+    manager.flush()
+    manager.append_message("session", {"role": "assistant", "content": "2"})
+    manager.flush()
+    assert len((tmp_path / "session.jsonl").read_bytes().splitlines()) == 2
+
+    trimmed = manager.load_history("session")[-1:]
+    trimmed.append({"role": "user", "content": "3"})
+    manager.save_history("session", trimmed)
+    manager.flush()
+
+    journal = (tmp_path / "session.jsonl").read_bytes().splitlines()
+    assert len(journal) == 2
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == [
+        {"role": "assistant", "content": "2"},
+        {"role": "user", "content": "3"},
+    ]
+
+def test_load_recent_reads_only_the_tail(manager, tmp_path):
+    messages = [{"role": "user", "content": str(i)} for i in range(50)]
+    manager.save_history("session", {"conversation_history": messages})
+    manager.flush()
+
+    recent = SessionManager(storage_dir=str(tmp_path)).load_recent("session", max_bytes=100)
+
+    assert 0 < len(recent) < 50
+    assert recent == messages[-len(recent):]
+
+def test_load_recent_keeps_a_line_that_starts_the_window(manager, tmp_path):
+    messages = [{"role": "user", "content": str(i)} for i in range(10)]
+    manager.save_history("session", messages)
+    manager.flush()
+    last_two = b"".join((tmp_path / "session.jsonl").read_bytes().splitlines(keepends=True)[-2:])
+
+    recent = SessionManager(storage_dir=str(tmp_path)).load_recent("session", max_bytes=len(last_two))
+    assert recent == messages[-2:]
+
+def test_guarded_save_rejects_stale_digest(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    digest = manager.session_digest("session")
+
+    other = SessionManager(storage_dir=str(tmp_path))
+    other.save_history("session", [{"role": "user", "content": "other writer"}], expected_prev_sha256=digest)
+
+    with pytest.raises(StalePrecondition):
+        manager.save_history("session", [{"role": "user", "content": "mine"}], expected_prev_sha256=digest)
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == [{"role": "user", "content": "other writer"}]
+
+def test_guarded_save_waits_for_the_write_lock(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    digest = manager.session_digest("session")
+    held, release = threading.Event(), threading.Event()
+
+    def background_write():
+        with manager._write_lock:
+            held.set()
+            release.wait()
+
+    holder = threading.Thread(target=background_write)
+    holder.start()
+    held.wait()
+    saver = threading.Thread(target=manager.save_history, args=("session", [{"role": "user", "content": "mine"}], digest))
+    saver.start()
+    saver.join(timeout=0.2)
+    assert saver.is_alive()
+
+    release.set()
+    holder.join()
+    saver.join()
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == [{"role": "user", "content": "mine"}]
+
+def test_delete_waits_for_the_write_lock(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+    held, release = threading.Event(), threading.Event()
+
+    def background_write():
+        with manager._write_lock:
+            held.set()
+            release.wait()
+
+    holder = threading.Thread(target=background_write)
+    holder.start()
+    held.wait()
+    deleter = threading.Thread(target=manager.delete_session, args=("session",))
+    deleter.start()
+    deleter.join(timeout=0.2)
+    assert deleter.is_alive() and "session" in manager._last_hash
+
+    release.set()
+    holder.join()
+    deleter.join()
+    assert "session" not in manager._last_hash and not (tmp_path / "session.json").exists()
+
+@pytest.mark.parametrize("session_id", ["../escape", "nested/session", ".hidden", ""])
+def test_rejects_unsafe_session_ids(manager, session_id):
+    with pytest.raises(ValueError):
+        manager.save_history(session_id, [])
+    with pytest.raises(ValueError):
+        manager.delete_session(session_id)
+
+def test_close_writes_pending_saves_and_can_restart(tmp_path):
+    manager = SessionManager(storage_dir=str(tmp_path), min_interval=60)
+    manager.close()
+
+    manager.save_history("first", [{"role": "user", "content": "hola"}])
+    manager.save_history("second", [{"role": "user", "content": "hola"}])
+    manager.close()
+
+    assert (tmp_path / "first.json").exists() and (tmp_path / "second.json").exists()
+
+def test_failed_replace_leaves_no_temp_file(manager, tmp_path):
+    with patch("session_manager.os.replace", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            manager._replace(manager._get_path("session"), b"{}\n")
+    assert list(tmp_path.iterdir()) == []
+
+def test_parallel_stat_lists_the_same_sessions(tmp_path):
+    manager = SessionManager(storage_dir=str(tmp_path), parallel_stat=True)
+    for i in range(40):
+        (tmp_path / f"s{i}.json").write_text("null\n")
+
+    ids = sorted(s["id"] for s in manager.list_sessions())
+    assert ids == sorted(f"s{i}" for i in range(40))
+
+def test_pretty_snapshot_is_opt_in(manager, tmp_path, monkeypatch):
+    manager.save_history("compact", {"conversation_history": [], "user": "ana"})
+    manager.flush()
+    monkeypatch.setenv("SESSION_PRETTY_JSON", "1")
+    manager.save_history("pretty", {"conversation_history": [], "user": "ana"})
+    manager.flush()
+
+    assert (tmp_path / "compact.json").read_bytes().count(b"\n") == 1
+    assert b'\n    "user": "ana"' in (tmp_path / "pretty.json").read_bytes()
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("pretty")["user"] == "ana"
+
+def test_storage_dir_is_created_on_first_save_and_after_removal(tmp_path):
+    storage = tmp_path / "sessions"
+    manager = SessionManager(storage_dir=str(storage))
+    assert not storage.exists()
+
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+    for path in storage.iterdir():
+        path.unlink()
+    storage.rmdir()
+
+    manager.save_history("session", [{"role": "user", "content": "hola"}, {"role": "assistant", "content": "hey"}])
+    manager.flush()
+    assert SessionManager(storage_dir=str(storage)).load_history("session")[-1]["content"] == "hey"
+
+def test_replace_retries_short_writes(manager, tmp_path):
+    real_write = os.write
+    with patch("session_manager.os.write", side_effect=lambda fd, data: real_write(fd, data[:3])):
+        manager._replace(manager._get_path("session"), b'{"a": "abcdef"}\n')
+    assert (tmp_path / "session.json").read_bytes() == b'{"a": "abcdef"}\n'
+
+def test_unchanged_save_skips_the_write(manager):
+    history = {"conversation_history": [{"role": "user", "content": "hola"}], "user": "ana"}
+    manager.save_history("session", history)
+    manager.flush()
+
+    with patch.object(manager, "_replace") as replace:
+        manager.save_history("session", manager.load_history("session"))
+        manager.flush()
+        replace.assert_not_called()
+
+        changed = manager.load_history("session")
+        changed["user"] = "luis"
+        manager.save_history("session", changed)
+        manager.flush()
+        replace.assert_called_once()
+
+def test_clearing_a_plain_history_is_not_skipped(manager, tmp_path):
+    manager.save_history("session", [{"role": "user", "content": "hola"}])
+    manager.flush()
+
+    with patch.object(manager, "_replace", wraps=manager._replace) as replace:
+        manager.save_history("session", [])
+        manager.flush()
+        assert replace.call_count == 2
+    assert SessionManager(storage_dir=str(tmp_path)).load_history("session") == []
+
+def test_append_message_to_context_without_history(manager, tmp_path):
+    manager.save_history("session", {"user_input": "hola"})
+    manager.append_message("session", {"role": "user", "content": "hola"})
+    manager.flush()
+
+    reloaded = SessionManager(storage_dir=str(tmp_path)).load_history("session")
+    assert reloaded == {"user_input": "hola", "conversation_history": [{"role": "user", "content": "hola"}]}